@@ -1,9 +1,100 @@
+import time
+LAUNCH_STARTED = time.perf_counter()     # Taken before the heavy imports so time-to-first-screen covers them too
+
+import argparse
 import tkinter as tk
 from src.dashboard import ImpliedVolatilityDashboard
+from src.session import DEFAULT_SESSION_PATH
+from src.bars import BAR_SIZES
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Implied Volatility Trading Dashboard")
+    parser.add_argument("--report", nargs="+", metavar="SYMBOL", help="Skip the GUI and write PNG + summary reports for these symbols")
+    parser.add_argument("--range", default="2 Y", help="IV range to query for reports (IB duration string)")
+    parser.add_argument("--bar-size", default="1 day", choices=list(BAR_SIZES), help="Bar size to query for reports")
+    parser.add_argument("--out", default="reports", help="Directory to write the reports to")
+    parser.add_argument("--format", choices=["html", "md"], default="html", help="Format of the summary table")
+    parser.add_argument("--workers", type=int, default=None, help="Render processes (defaults to the number of cores)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7497)
+    parser.add_argument("--client-id", type=int, default=44)
+    parser.add_argument("--alert-file", help="Also append IV alerts as JSON lines to this file")
+    parser.add_argument("--alert-webhook", help="Also POST IV alerts as JSON to this URL")
+    parser.add_argument("--alert-stdout", action="store_true", help="Also print IV alerts to stdout")
+    parser.add_argument("--session", default=DEFAULT_SESSION_PATH, help="Where the last session is saved and restored from")
+    parser.add_argument("--serve", action="store_true", help="Run the local IV data server: one TWS connection shared by every client")
+    parser.add_argument("--via-server", action="store_true", help="Get data from the local IV data server instead of TWS directly")
+    parser.add_argument("--server-port", type=int, default=7600, help="Port the local IV data server listens on")
+    return parser.parse_args()
+
+def run_report(args):
+    # Imported here so the GUI launch doesn't pay for the report machinery
+    from src.ib_client import start_ib_app
+    from src.iv_server import start_iv_client
+    from src.report import generate_reports
+
+    if args.via_server:
+        ib_app = start_iv_client("127.0.0.1", args.server_port)
+    else:
+        ib_app = start_ib_app(args.host, args.port, client_id=args.client_id)
+        if ib_app is None:
+            print(f"Failed to Connect to IB TWS at {args.host}:{args.port}")
+
+    if ib_app is None:
+        return
+
+    try:
+        summary = generate_reports(ib_app, args.report, duration=args.range, out_dir=args.out, bar_size=args.bar_size,
+                                   workers=args.workers, summary_format=args.format)
+        print(f"Summary: {summary}")
+    finally:
+        ib_app.disconnect()
+
+def run_server(args):
+    from src.ib_client import start_ib_app
+    from src.iv_server import IVServer
+
+    ib_app = start_ib_app(args.host, args.port, client_id=args.client_id)
+    if ib_app is None:
+        print(f"Failed to Connect to IB TWS at {args.host}:{args.port}")
+        return
+
+    server = IVServer(ib_app, address=("127.0.0.1", args.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        ib_app.disconnect()
+
+def build_alert_sinks(args):
+    from src.alerts import FileSink, WebhookSink, StdoutSink
+
+    sinks = []
+    if args.alert_file:
+        sinks.append(FileSink(args.alert_file))
+    if args.alert_webhook:
+        sinks.append(WebhookSink(args.alert_webhook))
+    if args.alert_stdout:
+        sinks.append(StdoutSink())
+    return sinks
 
 def main():
+    args = parse_args()
+
+    if args.serve:
+        run_server(args)
+        return
+
+    if args.report:
+        run_report(args)
+        return
+
     root = tk.Tk()
-    app = ImpliedVolatilityDashboard(root)
+    app = ImpliedVolatilityDashboard(root, alert_sinks=build_alert_sinks(args), session_path=args.session,
+                                     launch_started=LAUNCH_STARTED,
+                                     data_server=("127.0.0.1", args.server_port) if args.via_server else None)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,386 @@
+import sys
+import json
+import time
+import queue
+import threading
+import urllib.request
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from datetime import datetime
+from src.regimes import RegimeEngine
+
+"""
+Incremental IV alert engine. Keeps a small fixed size state per symbol (rolling percentile window, running mean / variance
+of IV changes, last regime) so an update is a couple of bisects plus one insert / delete in a sorted list of at most `window`
+floats (a memmove, microseconds even for thousands of bars), and memory is bounded by symbols x window, no matter how long it
+runs. update() only touches state and marks the symbol dirty; evaluate() runs the rules for dirty symbols only and hands
+any alerts to the sinks.
+
+State is kept per (symbol, bar size), so daily and intraday bars of one symbol never mix, and each can have its own window
+(in bars) to match the percentile window the dashboard uses for that bar size.
+
+Rules:
+    * Regime entry  -> IV percentile crosses into HIGH IV (above the top regime edge) or LOW IV (at/below the bottom edge).
+                       Leaving again needs the percentile to come back past the edge by `hysteresis` so it doesn't flap.
+    * IV jump       -> a single IV change more than `jump_k` standard deviations away from the running mean change.
+
+Each symbol can alert at most once every `min_interval` seconds; anything over that is counted as suppressed.
+
+"""
+
+
+class AlertSink():
+    """ Where alerts go. Subclasses just implement emit(alert), where alert is the dict built by AlertEngine. """
+
+    def emit(self, alert):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CallbackSink(AlertSink):
+    """ Passes the alert message to a function, e.g. the dashboard's log_message so alerts show up in the status area. """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, alert):
+        self.callback(f"ALERT: {alert['message']}")
+
+
+class StdoutSink(AlertSink):
+
+    def emit(self, alert):
+        print(f"[{alert['time']}] ALERT: {alert['message']}", file=sys.stdout, flush=True)
+
+
+class FileSink(AlertSink):
+    """ Appends every alert as one JSON line to a file. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, alert):
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(alert) + "\n")
+
+
+class WebhookSink(AlertSink):
+    """
+    POSTs every alert as JSON to a URL. Delivery happens on a background thread off a bounded queue so a slow endpoint never
+    stalls evaluate(); if the queue is full the alert is dropped (and counted) rather than growing memory.
+    """
+
+    def __init__(self, url, timeout=5, max_pending=1000):
+        self.url = url
+        self.timeout = timeout
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+
+        self._thread = threading.Thread(target=self._deliver, daemon=True)
+        self._thread.start()
+
+    def emit(self, alert):
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+
+    def _deliver(self):
+        while True:
+            alert = self._queue.get()
+            if alert is None:
+                return
+
+            request = urllib.request.Request(self.url, data=json.dumps(alert).encode(), headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except Exception as e:
+                print(f"Webhook Alert Error: {e}")
+
+    def close(self):
+        # Never block here: with a dead endpoint the queue can be full, so drop what's left to make room for the stop marker
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+        self._thread.join(timeout=self.timeout)
+
+
+class SymbolState():
+    """ Everything the engine remembers about one symbol. Fixed size: the two window containers are capped at `window`. """
+
+    __slots__ = ("window", "sorted_window", "evicted", "last_iv", "previous_iv", "last_change", "last_timestamp",
+                 "n_changes", "change_mean", "change_m2", "percentile", "regime", "zone", "jump", "last_alert", "suppressed")
+
+    def __init__(self, window):
+        self.window = deque(maxlen=window)
+        self.sorted_window = []
+        self.evicted = None         # Value the last push dropped off the front of the window, so retract() can put it back
+
+        self.last_iv = None
+        self.previous_iv = None     # IV before last_iv and the change between them, also for retract()
+        self.last_change = None
+        self.last_timestamp = None
+
+        # Welford running mean / variance of the bar to bar IV change
+        self.n_changes = 0
+        self.change_mean = 0.0
+        self.change_m2 = 0.0
+
+        self.percentile = None
+        self.regime = None
+        self.zone = None            # "HIGH", "LOW" or None -> the alerting state with hysteresis applied
+        self.jump = None            # Largest pending jump (in std devs) since the last evaluate
+        self.last_alert = None
+        self.suppressed = 0
+
+    def push(self, iv):
+        """ Adds one IV observation and returns its percentile within the window (None until the window has filled). """
+
+        self.evicted = None
+        if len(self.window) == self.window.maxlen:
+            self.evicted = self.window[0]
+            del self.sorted_window[bisect_left(self.sorted_window, self.evicted)]
+
+        self.window.append(iv)
+        insort(self.sorted_window, iv)
+
+        if len(self.window) < self.window.maxlen:
+            return None
+
+        # Same as pandas rolling rank(pct=True): ties get the average rank
+        below = bisect_left(self.sorted_window, iv)
+        at_or_below = bisect_right(self.sorted_window, iv)
+        return (below + at_or_below + 1) / 2 / len(self.sorted_window)
+
+    def retract(self):
+        """
+        Takes the last observation back out (window, running change stats and last IV), leaving the state as it was before
+        it. Used when the still forming bar is sent again with a new value.
+        """
+
+        del self.sorted_window[bisect_left(self.sorted_window, self.window.pop())]
+        if self.evicted is not None:
+            self.window.appendleft(self.evicted)
+            insort(self.sorted_window, self.evicted)
+            self.evicted = None
+
+        # Welford's update run backwards for the last change
+        if self.last_change is not None:
+            if self.n_changes == 1:
+                self.change_mean = self.change_m2 = 0.0
+            else:
+                previous_mean = (self.n_changes * self.change_mean - self.last_change) / (self.n_changes - 1)
+                self.change_m2 = max(self.change_m2 - (self.last_change - previous_mean) * (self.last_change - self.change_mean), 0.0)
+                self.change_mean = previous_mean
+            self.n_changes -= 1
+
+        self.last_iv = self.previous_iv
+        self.last_change = None
+
+    def std_change(self):
+        return (self.change_m2 / (self.n_changes - 1)) ** 0.5 if self.n_changes > 1 else 0.0
+
+
+class AlertEngine():
+
+    def __init__(self, sinks=None, window=252, jump_k=4.0, min_jump_samples=30, hysteresis=0.05, min_interval=300,
+                 regime_engine=None, clock=time.time):
+
+        self.sinks = list(sinks or [])
+        self.window = window
+        self.jump_k = jump_k
+        self.min_jump_samples = min_jump_samples
+        self.hysteresis = hysteresis
+        self.min_interval = min_interval
+        self.clock = clock
+
+        # HIGH / LOW thresholds come from the regime engine so alerts line up with what the dashboard labels
+        self.regime_engine = regime_engine or RegimeEngine()
+        self.high_edge = float(self.regime_engine.edges[-1])
+        self.low_edge = float(self.regime_engine.edges[0])
+
+        self.states = {}            # (symbol, bar size) -> SymbolState
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def _state(self, key, window=None):
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = SymbolState(window or self.window)
+        return state
+
+    def _observe(self, state, iv, timestamp):
+        """ Folds one IV value into the symbol's state. Returns the size of the move in std devs (None if not measurable yet). """
+
+        jump = None
+        change = None
+
+        if state.last_iv is not None:
+            change = iv - state.last_iv
+
+            # Measure the move against the history before it, then fold it in
+            if state.n_changes >= self.min_jump_samples:
+                std = state.std_change()
+                if std > 0:
+                    jump = (change - state.change_mean) / std
+
+            state.n_changes += 1
+            delta = change - state.change_mean
+            state.change_mean += delta / state.n_changes
+            state.change_m2 += delta * (change - state.change_mean)
+
+        state.previous_iv = state.last_iv
+        state.last_change = change
+        state.last_iv = iv
+        state.last_timestamp = timestamp
+        state.percentile = state.push(iv)
+
+        if state.percentile is not None:
+            state.regime = self.regime_engine.classify_one(state.percentile)
+
+        return jump
+
+    def seed(self, symbol, values, timestamps=None, bar_size="1 day", window=None):
+        """
+        Loads history for a symbol without alerting on it, so the first live update is judged against real context.
+
+        The zone is set from where the history ends, meaning a symbol that's already in HIGH IV won't alert until it leaves
+        and comes back. window (in bars) overrides the engine's default for this symbol / bar size.
+        """
+
+        timestamps = timestamps if timestamps is not None else [None] * len(values)
+        key = (symbol, bar_size)
+
+        with self._lock:
+            state = self._state(key, window)
+            for iv, timestamp in zip(values, timestamps):
+                self._observe(state, float(iv), timestamp)
+
+            state.zone = self._zone(state.zone, state.percentile)
+            state.jump = None
+            self._dirty.discard(key)
+
+    def update(self, symbol, iv, timestamp=None, bar_size="1 day"):
+        """
+        Feeds one new IV value. Cheap enough to call at tick rate; the rules don't run until evaluate().
+
+        A value with the same timestamp as the last one is the still forming bar being updated (e.g. today's daily bar on a
+        re-query), so it replaces the last observation instead of being added; that is how an intraday move in a daily bar
+        gets measured as a jump.
+        """
+
+        key = (symbol, bar_size)
+
+        with self._lock:
+            state = self._state(key)
+
+            if timestamp is not None and state.last_timestamp is not None:
+                # Ignore bars older than what we have (e.g. a re-query returning overlapping history)
+                if timestamp < state.last_timestamp:
+                    return
+
+                if timestamp == state.last_timestamp:
+                    if float(iv) == state.last_iv:
+                        return
+                    state.retract()
+
+            jump = self._observe(state, float(iv), timestamp)
+
+            if jump is not None and abs(jump) > self.jump_k and (state.jump is None or abs(jump) > abs(state.jump)):
+                state.jump = jump
+
+            self._dirty.add(key)
+
+    def _zone(self, zone, percentile):
+        """ Applies the hysteresis band to decide which alerting zone a percentile puts the symbol in. """
+
+        if percentile is None:
+            return zone
+
+        # Staying inside the band keeps the zone; leaving it falls through to a fresh look, so a one bar drop from HIGH
+        # straight to LOW (an IV crush) lands in LOW rather than nowhere
+        if zone == "HIGH" and percentile > self.high_edge - self.hysteresis:
+            return "HIGH"
+        if zone == "LOW" and percentile <= self.low_edge + self.hysteresis:
+            return "LOW"
+
+        if percentile > self.high_edge:
+            return "HIGH"
+        if percentile <= self.low_edge:
+            return "LOW"
+        return None
+
+    def evaluate(self):
+        """ Runs the alert rules for every symbol updated since the last call and sends what fires to the sinks. """
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            alerts = []
+
+            for key in dirty:
+                state = self.states[key]
+                symbol, bar_size = key
+                fired = []
+
+                # Daily alerts read as before; intraday ones say which bars they came from
+                name = symbol if bar_size == "1 day" else f"{symbol} ({bar_size})"
+
+                zone = self._zone(state.zone, state.percentile)
+                if zone is not None and zone != state.zone:
+                    label = self.regime_engine.label(state.regime)
+                    fired.append(("REGIME", f"{name} entered {label} territory (IV {state.last_iv:.4f}, Percentile {state.percentile:.1%})"))
+                state.zone = zone
+
+                if state.jump is not None:
+                    direction = "up" if state.jump > 0 else "down"
+                    fired.append(("JUMP", f"{name} IV jumped {direction} {abs(state.jump):.1f} std devs to {state.last_iv:.4f}"))
+                state.jump = None
+
+                if not fired:
+                    continue
+
+                now = self.clock()
+                if state.last_alert is not None and now - state.last_alert < self.min_interval:
+                    state.suppressed += len(fired)
+                    continue
+                state.last_alert = now
+
+                for kind, message in fired:
+                    alerts.append({
+                        "symbol": symbol,
+                        "bar_size": bar_size,
+                        "kind": kind,
+                        "message": message,
+                        "iv": state.last_iv,
+                        "percentile": state.percentile,
+                        "timestamp": str(state.last_timestamp) if state.last_timestamp is not None else None,
+                        "time": datetime.now().strftime("%H:%M:%S"),
+                    })
+
+        # Sinks run outside the lock so a slow one can't hold up update()
+        for alert in alerts:
+            for sink in self.sinks:
+                try:
+                    sink.emit(alert)
+                except Exception as e:
+                    print(f"Alert Sink Error: {e}")
+
+        return alerts
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,367 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from src import bars
+
+"""
+The IV pipeline without any tkinter in it. The dashboard and the report generator both go through these functions so the
+numbers on screen and in the reports always come from the same code.
+
+"""
+
+# Windows are calendar time, not bar counts. They get shorter with the bar size because IB only serves short ranges of
+# intraday bars (about a month of 5 min bars), and a one year window would leave nothing to classify or regress
+# bar size -> (IV percentile window, forward looking average IV horizon)
+LOOKBACK_WINDOWS = {
+    "1 day": (pd.Timedelta(days=365), pd.Timedelta(days=42)),       # One year percentile, ~30 trading days forward
+    "1 hour": (pd.Timedelta(days=90), pd.Timedelta(days=10)),
+    "15 mins": (pd.Timedelta(days=30), pd.Timedelta(days=3)),
+    "5 mins": (pd.Timedelta(days=10), pd.Timedelta(days=1)),
+}
+MIN_ANALYSIS_POINTS = 30        # Need at least this many aligned points to run the regressions
+MIN_REGIME_POINTS = 10          # Need more than this many points in a regime to regress it
+
+# Above this many points the scatter plots show an evenly spaced sample (the regressions still use everything)
+MAX_SCATTER_POINTS = 5000
+
+
+def analysis_params():
+    """ Everything that changes the analysis output besides the data itself; part of the result cache key. """
+
+    return (tuple(LOOKBACK_WINDOWS.items()), MIN_ANALYSIS_POINTS, MIN_REGIME_POINTS)
+
+
+def lookback_windows(bar_size, index):
+    """
+    The (percentile window, forward horizon) for a bar size. Intraday windows shrink together if the data doesn't span at
+    least two percentile windows, so at least half of whatever IB was willing to send still gets a percentile.
+    """
+
+    percentile_window, forward_horizon = LOOKBACK_WINDOWS[bar_size]
+
+    # Daily bars keep the one year window whatever range is picked -> 1 Y shows only the warm-up, like it always has,
+    # rather than a half year percentile that reads like the usual one
+    if bars.bar_length(bar_size) >= pd.Timedelta(days=1):
+        return percentile_window, forward_horizon
+
+    span = index[-1] - index[0] if len(index) > 0 else pd.Timedelta(0)
+    if span < 2 * percentile_window:
+        scale = (span / 2) / percentile_window
+        percentile_window, forward_horizon = percentile_window * scale, forward_horizon * scale
+
+    return percentile_window, forward_horizon
+
+
+def percentile_window_bars(bar_size, index):
+    """ Roughly how many bars the percentile window holds, for code that keeps a bar count window (the alert engine). """
+
+    percentile_window, _ = lookback_windows(bar_size, index)
+    trading_days = percentile_window / pd.Timedelta(days=365) * bars.TRADING_DAYS_PER_YEAR
+
+    return max(int(round(trading_days * bars.bars_per_day(bar_size))), 2)
+
+
+def bars_to_frame(bars):
+    """ Turns the list of bar dicts IB hands us into the equity dataframe (indexed by date) the rest of the pipeline expects. """
+
+    if not bars:
+        return None
+
+    equity_data = pd.DataFrame(bars)
+
+    # Intraday bars come back as "yyyyMMdd HH:mm:ss US/Eastern"; drop the time zone name since pandas can't parse it
+    equity_data['date'] = pd.to_datetime(equity_data['date'].astype(str).str.replace(r"\s+[A-Za-z_/]+$", "", regex=True))
+    equity_data.set_index('date', inplace=True)
+
+    equity_data['implied_vol'] = equity_data['close']
+
+    return equity_data
+
+
+def process_implied_volatility(equity_data, vol_annualization=252, bar_size="1 day"):
+    """
+    Annualizes the IV column of the equity data (in place) and adds the rolling IV percentile over the bar size's window.
+
+    Returns the volatility dataframe holding just the implied_vol and iv_percentile columns.
+    """
+
+    # Annualize the IV column
+    equity_data['implied_vol'] = equity_data['close']*np.sqrt(vol_annualization)
+
+    # Add IV percentile values over a calendar time window; NaN until a full window of history is available
+    percentile_window, _ = lookback_windows(bar_size, equity_data.index)
+    iv_percentile = equity_data['implied_vol'].rolling(window=percentile_window).rank(pct=True)
+    iv_percentile[equity_data.index < equity_data.index[0] + percentile_window] = np.nan
+    equity_data['iv_percentile'] = iv_percentile
+
+    return equity_data[["implied_vol", "iv_percentile"]].copy()
+
+
+def forward_average(series, horizon):
+    """
+    Mean of the values strictly after each timestamp and up to timestamp + horizon, computed with a cumulative sum and
+    searchsorted rather than a loop. Bars without a full horizon of data after them are NaN.
+    """
+
+    values = series.to_numpy(dtype=float)
+    times = series.index.values
+    totals = np.concatenate([[0.0], np.cumsum(values)])
+
+    start = np.arange(1, len(values) + 1)
+    end = np.searchsorted(times, times + horizon.to_timedelta64(), side="right")
+    count = end - start
+
+    forward = np.full(len(values), np.nan)
+    valid = (count > 0) & (times + horizon.to_timedelta64() <= times[-1]) if len(values) else count > 0
+    forward[valid] = (totals[end[valid]] - totals[start[valid]]) / count[valid]
+
+    return pd.Series(forward, index=series.index)
+
+
+def run_regressions(volatility_data, bar_size="1 day"):
+    """
+    Runs the forward IV regression, the vol diff regression and the per regime regressions.
+
+    Returns a dict with every stat the plots and logs need, or None if there isn't enough data to regress.
+    """
+
+    # First we need a 30 day forward IV dataframe | we get this from the volatility dataframe with out IV values
+    # For every bar this is the avg IV of the bars after it, up to the forward horizon ahead, so it makes it forward looking in sense
+    _, forward_horizon = lookback_windows(bar_size, volatility_data.index)
+    forward_vol_30d = forward_average(volatility_data['implied_vol'], forward_horizon)
+
+    # Okay now from all of this data, we are going to make an analysis dataframe
+    # The whole point of this is to match up the future data with the current data and see if there is any explanatory power there
+    analysis_df = pd.DataFrame({
+        "current_vol": volatility_data['implied_vol'],
+        "forward_30d_vol": forward_vol_30d,
+        "vol_diff": forward_vol_30d - volatility_data['implied_vol'],           # NaN for the last bars that don't have a full horizon ahead of them, dropped below
+        "vol_percentile": volatility_data['iv_percentile']
+    })
+
+    analysis_df = analysis_df.dropna()
+
+    # If we have insufficient data, return -> if len of analysis df is less than 30, we have nothing to regress
+    if len(analysis_df) < MIN_ANALYSIS_POINTS:
+        return None
+
+    # x = current_vol & y = forward_vol and try to see if there is some slope and intercept values that can explain the situation
+    slope1, intercept1, r1, p1, std_err1 = stats.linregress(
+        analysis_df['current_vol'], analysis_df['forward_30d_vol']
+    )
+
+    # x = current_vol & y = diff between forward and current vol | try to see if some slope and intercept can give us diff between current and forward vol
+    slope2, intercept2, r2, p2, std_err2 = stats.linregress(
+        analysis_df['current_vol'], analysis_df['vol_diff']
+    )
+
+    # Now we are trying to find a breakpoint to split regimes between high and low vol
+    if slope1 != 1:
+        x_intersection = intercept1/(1-slope1)
+    else:
+        x_intersection = analysis_df['current_vol'].median()        # If slope is 1 which means regress line is equal to y=x, then our regime split will be at the median IV value
+
+    # Whereever the condition is true, high_vol_regime will store a True value so high and low vol regime dfs are storing boolean values
+    high_vol_regime = analysis_df['current_vol'] > x_intersection       # Rmr x values are current vol values so if they are greater than intersection between y=x, that means every x value current vol results in a higher forward vol
+    low_vol_regime = analysis_df['current_vol'] <= x_intersection
+
+    # Do the regression for high vol regime
+    if high_vol_regime.sum() > MIN_REGIME_POINTS:      # If there are more than 10 True values essentially cause True is 1 as an int
+        slope_high, intercept_high, r_high, p_high, std_err_high = stats.linregress(
+            analysis_df.loc[high_vol_regime, 'current_vol'], analysis_df.loc[high_vol_regime, 'vol_diff']       # Basically filters the columns to only have values where high vol is True
+        )
+    else:
+        slope_high = intercept_high = r_high = p_high = std_err_high = None
+
+    # Same thing for low vol regime
+    if low_vol_regime.sum() > MIN_REGIME_POINTS:
+        slope_low, intercept_low, r_low, p_low, std_err_low = stats.linregress(
+            analysis_df.loc[low_vol_regime, 'current_vol'], analysis_df.loc[low_vol_regime, 'vol_diff']
+        )
+    else:
+        slope_low = intercept_low = r_low = p_low = std_err_low = None
+
+    return {
+        "analysis_df": analysis_df,
+        "slope1": slope1, "intercept1": intercept1, "r1": r1, "p1": p1,
+        "slope2": slope2, "intercept2": intercept2, "r2": r2, "p2": p2,
+        "x_intersection": x_intersection,
+        "high_vol_regime": high_vol_regime,
+        "low_vol_regime": low_vol_regime,
+        "slope_high": slope_high, "intercept_high": intercept_high, "r_high": r_high, "p_high": p_high,
+        "slope_low": slope_low, "intercept_low": intercept_low, "r_low": r_low, "p_low": p_low,
+    }
+
+
+def draw_analysis(fig, ax1, ax2, ax3, volatility_data, results, current_implied_vol, regime_engine=None, regime_stats=None,
+                  iv_series=None):
+    """
+    Draws the three analysis panels onto the axes passed in. The caller is responsible for drawing / saving the canvas.
+
+    If a regime engine and its stats for volatility_data are passed, the IV time series gets the regime bands shaded behind it.
+    iv_series is what gets drawn as the IV line (e.g. a coarser pyramid level for long intraday histories); defaults to the
+    full implied_vol column. Returns the IV line so callers can swap its data when zooming.
+    """
+
+    analysis_df = results["analysis_df"]
+    high_vol_regime = results["high_vol_regime"]
+    low_vol_regime = results["low_vol_regime"]
+    x_intersection = results["x_intersection"]
+
+    # Clear all of the subplots for graphing purposes
+    ax1.clear()
+    ax2.clear()
+    ax3.clear()
+
+    # Just added this
+    fig.subplots_adjust(left=0.06, right=0.98, top=0.92, bottom=0.12, wspace=0.3)
+
+    # Thin the points for the scatters only; intraday histories have far more than a scatter can show anyway
+    step = max(len(analysis_df) // MAX_SCATTER_POINTS, 1)
+    scatter_df = analysis_df.iloc[::step]
+    scatter_high = high_vol_regime.iloc[::step]
+    scatter_low = low_vol_regime.iloc[::step]
+
+    # loc='best' checks every plotted point against every legend spot, which dominates render time on intraday histories
+    legend_loc = 'best' if len(volatility_data) <= MAX_SCATTER_POINTS else 'upper left'
+
+    ax1.scatter(scatter_df["current_vol"], scatter_df['forward_30d_vol'], alpha=0.6, s=20)
+
+    x_range = np.linspace(analysis_df['current_vol'].min(), analysis_df['current_vol'].max(), 100)  # 100 points for x range
+    y_pred1 = results["slope1"] * x_range + results["intercept1"]
+    ax1.plot(x_range, y_pred1, "r-", linewidth=2, label=f"Regression R^2 = {results['r1']**2: .3f}")
+
+    # Need to plot the y=x line
+    min_val = min(analysis_df['current_vol'].min(), analysis_df['forward_30d_vol'].min())
+    max_val = max(analysis_df['current_vol'].max(), analysis_df['forward_30d_vol'].max())
+    ax1.plot([min_val, max_val], [min_val, max_val], "k--", linewidth=1, alpha=.7, label="y=x (No Change)")    # The point of this line is a reference, if the current IV is equal to the 30day forward IV, there is no change
+
+    ax1.set_xlabel("Current IV", fontsize=5)
+    ax1.set_ylabel("30-D Forward Avg IV", fontsize=5)
+    ax1.set_title(f"Forward IV vs. Current IV", fontsize=5)
+    ax1.legend(fontsize=5, loc=legend_loc)
+    ax1.grid(True, alpha=.3)
+    ax1.tick_params(labelsize=5)
+
+
+    """ Onto the Second Chart Now """
+
+    ax2.scatter(scatter_df.loc[scatter_high, 'current_vol'], scatter_df.loc[scatter_high, 'vol_diff'],
+                alpha=.6, s=20, color='red', label='High Vol Regime')
+
+    ax2.scatter(scatter_df.loc[scatter_low, 'current_vol'], scatter_df.loc[scatter_low, 'vol_diff'],
+                alpha=.6, s=20, color='blue', label='Low Vol Regime')
+
+    # If high regression executed
+    if results["slope_high"] is not None:
+        x_high = np.linspace(analysis_df.loc[high_vol_regime, 'current_vol'].min(),
+                             analysis_df.loc[high_vol_regime, 'current_vol'].max(), 100)
+        y_pred_high = results["slope_high"]*x_high + results["intercept_high"]
+        ax2.plot(x_high, y_pred_high, "r-", linewidth=2, label=f"High Regime R^2 = {results['r_high']**2: .3f}")
+
+    if results["slope_low"] is not None:
+        x_low = np.linspace(analysis_df.loc[low_vol_regime, 'current_vol'].min(),
+                            analysis_df.loc[low_vol_regime, 'current_vol'].max(), 100)
+        y_pred_low = results["slope_low"]*x_low + results["intercept_low"]
+        ax2.plot(x_low, y_pred_low, "b-", linewidth=2, label=f"Low Regime R^2 = {results['r_low']**2: .3f}")
+
+
+    # Rmr our no change for the unconditional regression was the y=x line. Now our y-value is the difference between current vol and forward vol. Now if the diff is 0, this is equal to our unconditional y=x line
+    # Since our y value for ax2 is the diff, if that diff is 0, meaning y=0 horizontal line is our no change line where current vol = forward vol
+    ax2.axhline(y=0, color="k", linestyle='--', linewidth=1, alpha=.7, label="No Change (y=0)")
+
+    # Place a vertical x line at the point of intersection on the unconditional regression
+    ax2.axvline(x=x_intersection, color="k", linestyle="--", linewidth=1, alpha=.7,
+                label=f"Regime Split (Vol = {x_intersection: .3f})")
+
+    ax2.set_xlabel('Current Implied Volatility', fontsize=5)
+    ax2.set_ylabel('Vol Diff (F - C)', fontsize=5)
+    ax2.set_title('Vol Diff vs Current Vol (Regime Analysis)', fontsize=5)
+    ax2.legend(fontsize=5, loc=legend_loc)
+    ax2.grid(True, alpha=0.3)
+    ax2.tick_params(labelsize=5)
+
+
+    """ Code for the Third Graph Starts Here """
+
+    # Shade the regime each bar was in behind the series
+    if regime_engine is not None and regime_stats is not None:
+        regime_engine.shade(ax3, volatility_data.index, regime_stats["codes"])
+
+    # This is the graph for showing IV overtime
+    if iv_series is None:
+        iv_series = volatility_data['implied_vol']
+
+    iv_line, = ax3.plot(iv_series.index, iv_series, label='Implied Volatility', linewidth=1)
+
+    # Add regime bands
+    vol_75th = volatility_data['implied_vol'].quantile(0.75)
+    vol_25th = volatility_data['implied_vol'].quantile(0.25)
+
+    # Add horizontal lines for seeing the percentiles
+    ax3.axhline(y=vol_75th, color='red', linestyle='--', alpha=0.7, label='75th Percentile')
+    ax3.axhline(y=vol_25th, color='green', linestyle='--', alpha=0.7, label='25th Percentile')
+    ax3.axhline(y=volatility_data['implied_vol'].mean(), color='black', linestyle='-', alpha=0.7, label='Mean')
+
+    if current_implied_vol is not None:
+        ax3.scatter(volatility_data.index[-1], current_implied_vol,
+                    color='red', s=100, zorder=5, label='Current')
+
+    ax3.set_xlabel('Date', fontsize=5)
+    ax3.set_ylabel('IV', fontsize=5)
+    ax3.set_title('IV Time Series', fontsize=5)
+    ax3.legend(fontsize=5, loc=legend_loc)
+    ax3.grid(True, alpha=0.3)
+
+    # Rotate x-axis labels for better readability
+    ax3.tick_params(axis='x', rotation=45, labelsize=3)
+    ax3.tick_params(axis='y', labelsize=5)
+
+    return iv_line
+
+
+def analysis_log_lines(results):
+    """ The regression summary and trading insights as the list of lines the dashboard logs to the status area. """
+
+    x_intersection = results["x_intersection"]
+    lines = []
+
+    lines.append(f"Regression 1 - Forward Vol on Current Vol:")
+    lines.append(f"  Slope: {results['slope1']:.4f}, Intercept: {results['intercept1']:.4f}")
+    lines.append(f"  R²: {results['r1']**2:.4f}, P-value: {results['p1']:.4f}")
+    lines.append(f"  Intersection with y=x at Vol = {x_intersection:.4f}")
+
+    lines.append(f"Regression 2 - Vol Difference on Current Vol:")
+    lines.append(f"  Slope: {results['slope2']:.4f}, Intercept: {results['intercept2']:.4f}")
+    lines.append(f"  R²: {results['r2']**2:.4f}, P-value: {results['p2']:.4f}")
+
+    lines.append(f"Regime Analysis:")
+    if results["slope_high"] is not None:
+        lines.append(f"  HIGH VOL regime (Vol > {x_intersection:.3f}):")
+        lines.append(f"    Slope: {results['slope_high']:.4f}, Intercept: {results['intercept_high']:.4f}")
+        lines.append(f"    R²: {results['r_high']**2:.4f}, P-value: {results['p_high']:.4f}")
+        lines.append(f"    Data points: {results['high_vol_regime'].sum()}")
+    else:
+        lines.append(f"  HIGH VOL regime: Insufficient data for regression")
+
+    if results["slope_low"] is not None:
+        lines.append(f"  LOW VOL regime (Vol ≤ {x_intersection:.3f}):")
+        lines.append(f"    Slope: {results['slope_low']:.4f}, Intercept: {results['intercept_low']:.4f}")
+        lines.append(f"    R²: {results['r_low']**2:.4f}, P-value: {results['p_low']:.4f}")
+        lines.append(f"    Data points: {results['low_vol_regime'].sum()}")
+    else:
+        lines.append(f"  LOW VOL regime: Insufficient data for regression")
+
+    # Trading insights
+    if results["slope1"] < 1:
+        lines.append("INSIGHT: Forward volatility tends to mean-revert (slope < 1)")
+    else:
+        lines.append("INSIGHT: Forward volatility tends to trend (slope > 1)")
+
+    if results["slope2"] < 0:
+        lines.append("INSIGHT: High current volatility predicts lower future volatility (mean reversion)")
+    else:
+        lines.append("INSIGHT: High current volatility predicts higher future volatility (momentum)")
+
+    return lines
+
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import matplotlib.dates as mdates
+
+"""
+Bar size handling and the multi-resolution pyramid used to plot long intraday histories.
+
+Annualization note: TWS reports option implied volatility in the units picked under Volatility & Analytics (this app
+expects Daily Volatility Units), and that is independent of the bar size requested. So the IV annualization factor is always
+the number of trading days in a year; what the bar size changes is how many bars make up a day / year, which is what the
+helpers below are for when converting between bar counts and calendar time.
+
+"""
+
+TRADING_DAYS_PER_YEAR = 252
+RTH_HOURS_PER_DAY = 6.5
+
+# IB barSizeSetting -> (bar length, pandas resample rule)
+BAR_SIZES = {
+    "5 mins": (pd.Timedelta(minutes=5), "5min"),
+    "15 mins": (pd.Timedelta(minutes=15), "15min"),
+    "1 hour": (pd.Timedelta(hours=1), "1h"),
+    "1 day": (pd.Timedelta(days=1), "1D"),
+}
+
+# Resolutions the pyramid pre-aggregates to, finest first
+PYRAMID_LEVELS = ("5 mins", "1 hour", "1 day")
+
+
+def bar_length(bar_size):
+    return BAR_SIZES[bar_size][0]
+
+
+def bars_per_day(bar_size):
+    """ Regular trading hours bars in one trading day (a partial last bar counts as a bar, like IB sends it). """
+
+    length = bar_length(bar_size)
+    if length >= pd.Timedelta(days=1):
+        return 1
+    return int(np.ceil(pd.Timedelta(hours=RTH_HOURS_PER_DAY) / length))
+
+
+def bars_per_year(bar_size):
+    return bars_per_day(bar_size) * TRADING_DAYS_PER_YEAR
+
+
+def vol_annualization(bar_size):
+    """ Factor (under the square root) that annualizes the IV IB reports for this bar size. See the note at the top. """
+
+    return TRADING_DAYS_PER_YEAR
+
+
+class IVPyramid():
+    """
+    Keeps an IV series at its native resolution plus pre-aggregated coarser copies (5m -> 1h -> 1d), so the plot can pick
+    the level that gives about one point per pixel for whatever time span is on screen instead of pushing every bar.
+    """
+
+    def __init__(self, series, bar_size):
+
+        self.levels = []        # (bar_size, series) finest first
+
+        native = bar_length(bar_size)
+        self.levels.append((bar_size, series))
+
+        # Aggregate from the level above, taking the last IV in each bucket (same as what a coarser IB bar would close at)
+        for level in PYRAMID_LEVELS:
+            if bar_length(level) <= native:
+                continue
+            coarser = self.levels[-1][1].resample(BAR_SIZES[level][1]).last().dropna()
+            self.levels.append((level, coarser))
+
+    def level_for(self, start, end, pixels):
+        """ Finest level with no more than ~one point per pixel between start and end; the coarsest level otherwise. """
+
+        for bar_size, series in self.levels:
+            index = series.index
+            count = index.searchsorted(end, side="right") - index.searchsorted(start, side="left")
+            if count <= pixels:
+                return bar_size, series
+
+        return self.levels[-1]
+
+    def view(self, start, end, pixels):
+        """ The slice of the best level for the window, padded by one point each side so the line reaches the axes edges. """
+
+        bar_size, series = self.level_for(start, end, pixels)
+        lo = max(series.index.searchsorted(start, side="left") - 1, 0)
+        hi = series.index.searchsorted(end, side="right") + 1
+
+        return bar_size, series.iloc[lo:hi]
+
+    def view_for_axes(self, ax):
+        """ view() for what an axes is currently showing; its x limits are matplotlib date numbers. """
+
+        start, end = (pd.Timestamp(mdates.num2date(x)).tz_localize(None) for x in ax.get_xlim())
+        return self.view(start, end, max(int(ax.bbox.width), 1))
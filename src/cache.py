@@ -0,0 +1,163 @@
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+from src.bars import IVPyramid
+
+"""
+Result cache shared by the fetch and analysis steps.
+
+    * Memoization  -> results are kept in an LRU that is bounded by (estimated) bytes, not entry count, since one intraday
+                      frame can be the size of hundreds of daily ones.
+    * Coalescing   -> if a key is already being fetched / computed, later callers wait on the same Future instead of
+                      starting their own, so two clicks (or two threads) for the same symbol cost one reqHistoricalData.
+    * Invalidation -> every symbol has a data version. Callers put it in their keys, and when new bars show up for a
+                      symbol its version is bumped and only the entries tagged with that symbol are dropped.
+
+"""
+
+
+def estimate_size(value):
+    """ Rough size in bytes of a cached value; good enough to keep the cache near its memory budget. """
+
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, IVPyramid):
+        return sys.getsizeof(value) + estimate_size(value.levels)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache():
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._entries = OrderedDict()       # key -> (value, size, symbol), oldest first
+        self._in_flight = {}                # key -> Future shared by everyone waiting on that key
+        self._versions = {}                 # symbol -> data version
+        self._fingerprints = {}             # (symbol, stream) -> fingerprint of the last data seen on that stream
+        self._lock = threading.Lock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def version(self, symbol):
+        with self._lock:
+            return self._versions.get(symbol, 0)
+
+    def update_data_version(self, symbol, fingerprint, stream=None):
+        """
+        Records the latest data seen for a symbol on one stream (e.g. a bar size). The fingerprint should only describe the
+        bars themselves (say the last bar's date and close), not which view of them was asked for; that belongs in the keys.
+
+        If it differs from the last fingerprint seen on the same stream, new bars have come in, so the symbol's version is
+        bumped and every entry derived from the old data is dropped. The first data seen on a stream has nothing derived
+        from it yet and leaves the version alone. Returns the (possibly new) version.
+        """
+
+        with self._lock:
+            previous = self._fingerprints.get((symbol, stream))
+            self._fingerprints[(symbol, stream)] = fingerprint
+
+            if previous is not None and previous != fingerprint:
+                self._versions[symbol] = self._versions.get(symbol, 0) + 1
+                self._drop_symbol(symbol)
+
+            return self._versions.get(symbol, 0)
+
+    def invalidate(self, symbol):
+        """ Forces a new data version for the symbol and drops everything cached for it. """
+
+        with self._lock:
+            self._versions[symbol] = self._versions.get(symbol, 0) + 1
+            self._drop_symbol(symbol)
+
+    def _drop_symbol(self, symbol):
+        for key in [k for k, (_, _, entry_symbol) in self._entries.items() if entry_symbol == symbol]:
+            _, size, _ = self._entries.pop(key)
+            self.current_bytes -= size
+
+    def get_or_compute(self, key, compute, symbol=None, store=True):
+        """
+        Returns the cached value for key, or runs compute() to make it.
+
+        Concurrent callers with the same key share one compute() call. With store=False the result is only shared with the
+        callers already waiting (request coalescing) and not kept afterwards, which is what fetches want.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                started_version = self._versions.get(symbol, 0)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+            # If the symbol's data moved on while we were computing, this result is already stale, so don't keep it
+            if store and self._versions.get(symbol, 0) == started_version:
+                self._store(key, value, symbol)
+
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value, symbol):
+        size = self.sizeof(value)
+
+        # Something bigger than the whole budget would just evict everything and then itself, so don't bother
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+
+        self._entries[key] = (value, size, symbol)
+        self.current_bytes += size
+
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
@@ -1,15 +1,20 @@
 import tkinter as tk
 from tkinter import messagebox, ttk, scrolledtext
 import threading 
+import queue
 from datetime import datetime
 import time
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from scipy import stats
-from ibapi.contract import Contract
-from src.ib_client import IBApp
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from src.ib_client import IBApp, create_equity_contract
+from src.iv_server import IVClient
+from src import analysis
+from src.regimes import RegimeEngine
+from src.alerts import AlertEngine, CallbackSink
+from src.session import DEFAULT_SESSION_PATH, save_session, load_session
+from src.cache import ResultCache
+from src import bars
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -23,28 +28,74 @@ giant class; might change after if expanding
 class ImpliedVolatilityDashboard():
 
     # The root being passed in is just tk.Tk() -> its how you initialize a tkinter app
-    def __init__(self, root):
+    def __init__(self, root, alert_sinks=None, session_path=DEFAULT_SESSION_PATH, launch_started=None, data_server=None):
 
         self.root = root
 
+        # Used to measure how long it takes from launch until there is something useful on screen
+        self.launch_started = launch_started if launch_started is not None else time.perf_counter()
+
         self.root.title("Implied Volatility Trading Dashboard")
         self.root.geometry("1400x1200")
 
         # These fields will be populated with IB data later
         self.option_data = None
+        self.equity_data = None
         self.volatility_data = None
         self.current_implied_vol = None
+        self.analysis_results = None
+
+        # What the data on screen is for; also what gets saved as the session
+        self.current_symbol = None
+        self.current_range = None
+        self.session_path = session_path
+        self.stale_saved_at = None      # When the restored data on screen was saved; None once it has been refreshed
+
+        # Fetches are coalesced through this cache and processing / analysis results are memoized in it, keyed by the
+        # symbol's data version so new bars only invalidate what was derived from that symbol
+        self.cache = ResultCache()
+        self.bar_size = "1 day"     # Bar size of the data on screen (the combobox only applies on the next query)
+        self.data_version = None
+        self.drawn_key = None       # Cache key of the analysis currently drawn on the canvas
+
+        # Pre-aggregated copies of the IV series so the time series plot can show ~one point per pixel when zoomed
+        self.iv_pyramid = None
+        self.iv_line = None
 
         # Very convenient way to handle any requests made to the IB server for data
-        self.ib_app = IBApp()
+        # With a data server (host, port) we go through the local IV server instead, which shares one TWS connection between
+        # every dashboard on the machine. IVClient connects like IBApp; only fetch_history / process_implied_volatility tell
+        # them apart, to take the series the server already processed instead of redoing the work
+        self.data_server = data_server
+        self.ib_app = IVClient() if data_server else IBApp()
         self.connected = False
 
-        # Set a default vol annualization -> this is for daily because there are 252 trading days in a year | would be different for weekly bars or monthly bars
-        self.vol_annualization = 252
+        # Streaming updates pushed by the IV server land here (off the UI thread) until poll_server_updates picks them up
+        self.server_updates = queue.Queue()
+        self.followed_key = None
+
+        # IB reports IV in daily units whatever the bar size, so this is 252 trading days for every bar size (see src/bars.py)
+        self.vol_annualization = bars.vol_annualization(self.bar_size)
+
+        # Classifies the whole percentile history into regimes; regime_stats is refreshed every time new IV data is processed
+        self.regime_engine = RegimeEngine()
+        self.regime_stats = None
 
         # This function will contain all of the tkinter UI logic and will setup the entire UI
         self.setup_ui()
 
+        # Alerts always go to the status log, plus any extra sinks passed in (file, webhook, stdout)
+        self.alert_engine = AlertEngine(sinks=[CallbackSink(self.log_message)] + list(alert_sinks or []),
+                                        regime_engine=self.regime_engine)
+
+        # Save the session when the window is closed
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Warm start -> put the last session on screen right away (marked stale) and refresh it from IB in the background
+        if self.restore_session():
+            self.root.after_idle(self.log_first_screen)
+            self.start_background_refresh(self.current_symbol, self.current_range)
+
     
     def create_equity_contract(self, symbol):
         """ 
@@ -54,13 +105,7 @@ class ImpliedVolatilityDashboard():
         entered symbol is created to then query data from IB server. 
         """
         
-        contract = Contract()
-        contract.symbol = symbol.upper()
-        contract.secType = "STK"    # Stock
-        contract.exchange = "SMART" 
-        contract.currency = "USD"
-
-        return contract
+        return create_equity_contract(symbol)
 
     def setup_ui(self):
         
@@ -80,17 +125,18 @@ class ImpliedVolatilityDashboard():
 
         """ Connection Widget Code Start """
         # Create a connection widget or frame within the mainframe and position it
-        conn_frame = ttk.LabelFrame(main_frame, text="Interactive Brokers Connection", padding="5")
+        conn_title = "IV Data Server Connection" if self.data_server else "Interactive Brokers Connection"
+        conn_frame = ttk.LabelFrame(main_frame, text=conn_title, padding="5")
         conn_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0,10))
 
         # Within the connection frame, add a Host field to extract the Host connecting to the IB server; default is local host
         ttk.Label(conn_frame, text="Host:").grid(row=0, column=0, padx=(0,5))
-        self.host_var = tk.StringVar(value="127.0.0.1")
+        self.host_var = tk.StringVar(value=self.data_server[0] if self.data_server else "127.0.0.1")
         ttk.Entry(conn_frame, textvariable=self.host_var, width=15).grid(row=0, column=1, padx=(0,10))
 
         # Within the connection frame, add a Port field to specify what port to run IB server on
         ttk.Label(conn_frame, text="Port:").grid(row=0, column=2, padx=(0,5))
-        self.port_var = tk.StringVar(value="7497")
+        self.port_var = tk.StringVar(value=str(self.data_server[1]) if self.data_server else "7497")
         ttk.Entry(conn_frame, textvariable=self.port_var, width=15).grid(row=0, column=3, padx=(0,10))
 
         # Within the connection frame, create a connect button which connects to the IB server
@@ -118,13 +164,18 @@ class ImpliedVolatilityDashboard():
         self.iv_range_var = tk.StringVar(value="2 Y")
         ttk.Entry(data_frame, textvariable=self.iv_range_var, width=15).grid(row=0, column=3, padx=(0,10))      # Entry in col 3
 
+        # Within the data frame, create a dropdown for the bar size (intraday bars need a short IV range, IB limits how far back they go)
+        ttk.Label(data_frame, text="Bar Size:").grid(row=0, column=4, padx=(0,5))
+        self.bar_size_var = tk.StringVar(value="1 day")
+        ttk.Combobox(data_frame, textvariable=self.bar_size_var, values=list(bars.BAR_SIZES), state="readonly", width=10).grid(row=0, column=5, padx=(0,10))
+
         # Within the data frame, create a data query button which queries the IB server for data
         self.data_query_btn = ttk.Button(data_frame, text="Query IV Data", command=self.query_data)
-        self.data_query_btn.grid(row=0, column=4, padx=(0,10))
+        self.data_query_btn.grid(row=0, column=6, padx=(0,10))
 
         # Within the data frame, create a disconnect button which disconnects from the IB server
         self.analyze_btn = ttk.Button(data_frame, text="Analyze Implied Vol", command=self.analyze_volatility)
-        self.analyze_btn.grid(row=0, column=5, padx=(0,10))
+        self.analyze_btn.grid(row=0, column=7, padx=(0,10))
 
         """ Data Widget Code End """
 
@@ -149,7 +200,12 @@ class ImpliedVolatilityDashboard():
         # Within the vol frame, add a label for the computation statistics over the entered range of the IV
         ttk.Label(vol_frame, text="Vol Stats:").grid(row=0, column=4, padx=(0,5))
         self.vol_statistics_label = ttk.Label(vol_frame, text="N/A", font=("Arial", 10))
-        self.vol_statistics_label.grid(row=0, column=5)
+        self.vol_statistics_label.grid(row=0, column=5, padx=(0,20))
+
+        # Within the vol frame, add a label saying whether the data on screen is live or restored from the last session
+        ttk.Label(vol_frame, text="Data:").grid(row=0, column=6, padx=(0,5))
+        self.data_status_label = ttk.Label(vol_frame, text="No Data", font=("Arial", 10, "bold"))
+        self.data_status_label.grid(row=0, column=7)
 
         """ Volatility Widget Code End """
 
@@ -171,7 +227,12 @@ class ImpliedVolatilityDashboard():
         # Within the regime frame, add a mean reversion signal
         ttk.Label(regime_frame, text="Mean Reversion Signal:").grid(row=0, column=4, padx=(0, 5))
         self.reversion_label = ttk.Label(regime_frame, text="N/A", font=("Arial", 10))
-        self.reversion_label.grid(row=0, column=5)
+        self.reversion_label.grid(row=0, column=5, padx=(0, 20))
+
+        # Within the regime frame, add the expected number of days until IV is back in the normal regime
+        ttk.Label(regime_frame, text="Exp. Days to Revert:").grid(row=0, column=6, padx=(0, 5))
+        self.revert_time_label = ttk.Label(regime_frame, text="N/A", font=("Arial", 10))
+        self.revert_time_label.grid(row=0, column=7)
         
         """ Vol Regime Widget Code End """
 
@@ -202,6 +263,11 @@ class ImpliedVolatilityDashboard():
         self.canvas = FigureCanvasTkAgg(self.fig, plot_frame)
         self.canvas.get_tk_widget().grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
 
+        # Zoom / pan toolbar under the plots; zooming the time series is what makes it swap to a finer pyramid level
+        self.toolbar = NavigationToolbar2Tk(self.canvas, plot_frame, pack_toolbar=False)
+        self.toolbar.update()
+        self.toolbar.grid(row=1, column=0, sticky=tk.W)
+
         """ Plot Frame Widget Code End """
 
     def log_message(self, message):
@@ -243,24 +309,30 @@ class ImpliedVolatilityDashboard():
 
             # Now if we do connect successfully to IB, do the following
             if self.ib_app.connected:
-                self.connected = True
-                self.connect_btn.config(state="disabled")       # Disable the connect button if connected
-                self.disconnect_btn.config(state="normal")      # Enable the disconnect button
-                self.data_query_btn.config(state="normal")      # Enable the data query button
-                # Notice we didn't enable the analyze button here because we need to query the data first
-                self.log_message("Successfully Connected to IB TWS")
+                self.on_ib_connected()
             else:
                 self.log_message("Failed to Connect to IB TWS")
 
         except Exception as e:
             self.log_message(f"Connection Error: {e}")
     
+    def on_ib_connected(self):
+        """ Flips the UI into the connected state, whether we connected from the button or from the background refresh. """
+
+        self.connected = True
+        self.connect_btn.config(state="disabled")       # Disable the connect button if connected
+        self.disconnect_btn.config(state="normal")      # Enable the disconnect button
+        self.data_query_btn.config(state="normal")      # Enable the data query button
+        # Notice we didn't enable the analyze button here because we need to query the data first
+        self.log_message("Successfully Connected to IB TWS")
+
     def disconnect_ib(self):
 
         try:
             # Note that these ib_app functions are coming from the EClient class that we inherited from
             self.ib_app.disconnect()
             self.connected = False
+            self.followed_key = None        # Also stops poll_server_updates
             self.connect_btn.config(state="normal")
             self.disconnect_btn.config(state="disabled")
             self.data_query_btn.config(state="disabled")
@@ -284,62 +356,109 @@ class ImpliedVolatilityDashboard():
         # Get the symbol and the duration from the tk fields
         symbol = self.symbol_var.get().upper()
         vol_range = self.iv_range_var.get()
+        bar_size = self.bar_size_var.get()
 
-        self.log_message(f"Querying Implied Volatility for {symbol}...")
+        self.log_message(f"Querying Implied Volatility for {symbol} ({bar_size} bars)...")
 
-        # Clear any historical data already present within dict
-        self.ib_app.historical_data.clear()
+        equity_data = self.fetch_history(symbol, vol_range, bar_size)
 
-        # Create an equity contract for the entered symbol
-        contract = self.create_equity_contract(symbol)
+        self.load_equity_data(symbol, vol_range, bar_size, equity_data)
 
-        # Request historical data
-        self.ib_app.reqHistoricalData(
-            reqId=1, 
-            contract=contract,
-            endDateTime="",
-            durationStr=vol_range,
-            barSizeSetting="1 day",
-            whatToShow="OPTION_IMPLIED_VOLATILITY",
-            useRTH=1,
-            formatDate=1,
-            keepUpToDate=False,
-            chartOptions=[]
-        )
+    def fetch_history(self, symbol, vol_range, bar_size):
+        """
+        Requests the IV history as an equity dataframe (None if there is none), sharing the request with anyone already
+        fetching the exact same thing. From the IV server it comes back already processed, see process_implied_volatility.
+        """
 
-        # Wait 15 seconds for the historical data to come
-        timeout=15
-        start = time.time()
+        def fetch():
+            # Request historical data and wait up to 15 seconds for it to come
+            if isinstance(self.ib_app, IVClient):
+                series = self.ib_app.request_series(symbol, vol_range, bar_size=bar_size, timeout=15)
+                return series if len(series) > 0 else None
 
-        while 1 not in self.ib_app.historical_data and (time.time() - start) < timeout:
-            time.sleep(0.1)
+            return analysis.bars_to_frame(self.ib_app.request_historical_iv(symbol, vol_range, bar_size=bar_size, timeout=15))
 
-        if 1 in self.ib_app.historical_data:
-            data = self.ib_app.historical_data[1]
-            if len(data) > 0:
-                self.equity_data = pd.DataFrame(data)
-                self.equity_data['date'] = pd.to_datetime(self.equity_data['date'])
-                self.equity_data.set_index('date', inplace=True)
+        return self.cache.get_or_compute(("fetch", symbol, vol_range, bar_size), fetch, store=False)
 
-                self.equity_data['implied_vol'] = self.equity_data['close']
+    def cache_key(self, kind):
+        """ Key for a memoized result derived from the current symbol's data. """
 
-                self.log_message(f"Recieved {len(self.equity_data)} implied volatility data points for {symbol}")
-                self.log_message(f'Date Range: {self.equity_data.index.min()} to {self.equity_data.index.max()}')
-                self.log_message(f"Note: All IV values are annulaized. ")
+        return (kind, self.current_symbol, self.current_range, self.bar_size, self.vol_annualization,
+                analysis.analysis_params(), tuple(self.regime_engine.edges), self.data_version)
 
-                self.process_implied_volatility()
+    def load_equity_data(self, symbol, vol_range, bar_size, equity_data):
+        """ Takes the IV history fetched for a symbol (see fetch_history) and runs it through processing. """
 
-                self.analyze_btn.config(state="normal")     # Once the data has been recieved, allow the user to analyze it
+        self.current_symbol = symbol
+        self.current_range = vol_range
+        self.bar_size = bar_size
+        self.vol_annualization = bars.vol_annualization(bar_size)
 
-            else:
-                self.log_message("No IV Data Recieved")
-                self.equity_data = None
+        if equity_data is not None and len(equity_data) > 0:
+            self.equity_data = equity_data
+
+            # Only new bars (a later or updated last bar at this bar size) drop what's cached for the symbol; switching range or
+            # bar size doesn't, since both are part of every cache key already
+            last_bar = (equity_data.index[-1], equity_data['close'].iloc[-1])
+            self.data_version = self.cache.update_data_version(symbol, last_bar, stream=bar_size)
+
+            self.log_message(f"Recieved {len(self.equity_data)} implied volatility data points for {symbol}")
+            self.log_message(f'Date Range: {self.equity_data.index.min()} to {self.equity_data.index.max()}')
+            self.log_message(f"Note: All IV values are annulaized. ")
+
+            self.process_implied_volatility()
+            self.set_data_status(stale=False)
+            self.follow_server_updates(symbol, vol_range, bar_size)
+
+            self.analyze_btn.config(state="normal")     # Once the data has been recieved, allow the user to analyze it
 
         else:
             self.log_message("No IV Data Recieved -> May Not Be Avaliable For Symbol")
             self.equity_data = None
 
 
+    def follow_server_updates(self, symbol, vol_range, bar_size):
+        """ When running off the IV server, subscribe to the data on screen (and drop the old subscription) so new bars stream in. """
+
+        key = (symbol, vol_range, bar_size)
+        if not isinstance(self.ib_app, IVClient) or not self.ib_app.connected or key == self.followed_key:
+            return
+
+        try:
+            if self.followed_key is not None:
+                self.ib_app.unsubscribe(*self.followed_key)
+
+            # The callback runs on the client's reader thread, so it only queues the series for the UI thread
+            self.ib_app.subscribe(symbol, vol_range, bar_size, lambda *update: self.server_updates.put(update))
+            if self.followed_key is None:
+                self.root.after(1000, self.poll_server_updates)
+            self.followed_key = key
+
+        except Exception as e:
+            self.log_message(f"IV Server Subscribe Error: {e}")
+
+    def poll_server_updates(self):
+        """ Applies the newest pushed update for the data on screen, then checks again in a second. """
+
+        latest = None
+        while True:
+            try:
+                update = self.server_updates.get_nowait()
+            except queue.Empty:
+                break
+            if update[:3] == self.followed_key:
+                latest = update
+
+        if latest is not None:
+            symbol, vol_range, bar_size, series = latest
+            self.log_message(f"New IV bars for {symbol} from the IV server")
+            self.load_equity_data(symbol, vol_range, bar_size, series)
+            if self.equity_data is not None:
+                self.analyze_volatility()
+
+        if self.followed_key is not None:
+            self.root.after(1000, self.poll_server_updates)
+
     def process_implied_volatility(self):
         """ Function that executed after IV data is recieved. """
 
@@ -350,21 +469,38 @@ class ImpliedVolatilityDashboard():
         self.log_message("Processing IV Data...")
         self.log_message(f"Note: All IV values are annulaized. ")
 
-        # Annualize the IV column
-        self.equity_data['implied_vol'] = self.equity_data['close']*np.sqrt(self.vol_annualization)
+        # Intraday windows shrink when IB sent less than two of them -> say so, the percentiles mean something shorter
+        percentile_window, forward_horizon = analysis.lookback_windows(self.bar_size, self.equity_data.index)
+        if percentile_window < analysis.LOOKBACK_WINDOWS[self.bar_size][0]:
+            self.log_message(f"Short history: percentile window {percentile_window.round('h')}, forward IV {forward_horizon.round('h')}")
+
+        def process():
+            if "regime" in self.equity_data:
+                # Series from the IV server were annualized, ranked and classified once there for every client -> use them as is
+                volatility_data = self.equity_data[["implied_vol", "iv_percentile"]].copy()
+                regime_stats = self.regime_engine.analyze(volatility_data['iv_percentile'].to_numpy(),
+                                                          codes=self.equity_data['regime'].to_numpy())
+            else:
+                # Annualize the IV column and add the IV percentile values
+                volatility_data = analysis.process_implied_volatility(self.equity_data, self.vol_annualization, self.bar_size)
+
+                # Classify every bar's regime at once, along with how long regimes last and how they transition
+                regime_stats = self.regime_engine.analyze(volatility_data['iv_percentile'].to_numpy())
 
-        # Add IV percentile values
-        self.equity_data['iv_percentile'] = self.equity_data['implied_vol'].rolling(window=252).rank(pct=True)
+            return volatility_data, regime_stats, bars.IVPyramid(volatility_data['implied_vol'], self.bar_size)
+
+        self.volatility_data, self.regime_stats, self.iv_pyramid = self.cache.get_or_compute(self.cache_key("process"), process, symbol=self.current_symbol)
 
         # Current IV 
-        self.current_implied_vol = self.equity_data['implied_vol'].iloc[-1] if len(self.equity_data) > 0 else None
+        self.current_implied_vol = self.volatility_data['implied_vol'].iloc[-1] if len(self.volatility_data) > 0 else None
 
-        self.volatility_data = self.equity_data[["implied_vol", "iv_percentile"]].copy()
         print(f"volatility_data: \n {self.volatility_data}")
 
         # Update the GUI display based on the current fetched IV data
         self.update_current_vol_display()
 
+        self.update_alerts(self.current_symbol)
+
         if self.current_implied_vol is not None:
             self.log_message(f"Current IV: {self.current_implied_vol: .4f} ({self.current_implied_vol*100: .2f}%)")
             self.log_message(f"IV Range: {self.volatility_data['implied_vol'].min(): .4f} - {self.volatility_data['implied_vol'].max(): .4f}")
@@ -373,6 +509,30 @@ class ImpliedVolatilityDashboard():
 
 
 
+    def update_alerts(self, symbol):
+        """ Feeds any bars the alert engine hasn't seen yet for this symbol and runs the alert rules. """
+
+        if self.volatility_data is None:
+            return
+
+        implied_vol = self.volatility_data['implied_vol']
+        state = self.alert_engine.states.get((symbol, self.bar_size))
+
+        # First time we see a symbol at this bar size, load its history silently so we only alert on what happens from here
+        # on, with the alert window matching the percentile window the regimes on screen use
+        if state is None:
+            window = analysis.percentile_window_bars(self.bar_size, implied_vol.index)
+            self.alert_engine.seed(symbol, implied_vol.to_numpy(), implied_vol.index, bar_size=self.bar_size, window=window)
+            return
+
+        # >= so the last bar we saw is fed again: if it was still forming, its new value replaces the old one
+        new_bars = implied_vol[implied_vol.index >= state.last_timestamp] if state.last_timestamp is not None else implied_vol
+        for timestamp, iv in new_bars.items():
+            self.alert_engine.update(symbol, iv, timestamp, bar_size=self.bar_size)
+
+        self.alert_engine.evaluate()
+
+
     def update_current_vol_display(self):
         """ Based on the fetched implied vol data, update the GUI """
 
@@ -413,6 +573,7 @@ class ImpliedVolatilityDashboard():
             self.regime_label.config(text="N/A")
             self.percentile_label.config(text="N/A")
             self.reversion_label.config(text="N/A")
+            self.revert_time_label.config(text="N/A")
 
     def update_regime_analysis(self):
         # If we have no data, then there is nothing to do here, pretty redundant but still good for safe measure
@@ -421,22 +582,10 @@ class ImpliedVolatilityDashboard():
         
         current_percentile = self.volatility_data["iv_percentile"].iloc[-1]
 
-        # Basically just ranks the IV
-        if current_percentile > 0.8:
-            regime = "HIGH IV"
-            color = "red"
-        elif current_percentile > 0.6:
-            regime = "ABOVE AVG IV"
-            color="orange"
-        elif current_percentile > 0.4:
-            regime="NORMAL VOL"
-            color="black"
-        elif current_percentile > 0.2:
-            regime="BELOW AVG IV"
-            color="deep sky blue"
-        else:
-            regime="LOW IV"
-            color="green"
+        # The regime for the latest bar comes straight out of the full history classification
+        regime_code = self.regime_stats["codes"][-1]
+        regime = self.regime_engine.label(regime_code)
+        color = self.regime_engine.color(regime_code)
 
         # Configure the regime tab
         self.regime_label.config(text=regime, foreground=color)
@@ -444,16 +593,26 @@ class ImpliedVolatilityDashboard():
 
         # Now the way IV works is that it tends to be mean reverting, and ofc the mean is time variant, but it does tend to be mean reverting
         # We can express this by adding the reversion label
-        if current_percentile > .8:
+        if regime_code == self.regime_engine.n_regimes - 1:
             reversion = "EXPECT MEAN REVERSION DOWN"
             rev_color = "red"
-        elif current_percentile < .2:
+        elif regime_code == 0:
             reversion = "EXPECT MEAN REVERSION UP"
             rev_color = "deep sky blue"
         else:
             reversion = "NEUTRAL"
             rev_color = "BLACK"
 
+        # How long the empirical regime chain says it takes from here to get back to normal
+        revert_time = self.regime_stats["time_to_revert"][regime_code] / bars.bars_per_day(self.bar_size) if regime_code >= 0 else np.nan
+        if np.isnan(revert_time):
+            revert_text = "N/A"
+        elif np.isinf(revert_time):
+            revert_text = "Never Observed"
+        else:
+            revert_text = f"{revert_time: .1f}"
+        self.revert_time_label.config(text=revert_text)
+
         self.reversion_label.config(text=reversion, foreground=rev_color)
 
 
@@ -461,201 +620,219 @@ class ImpliedVolatilityDashboard():
         
         # Again, if no data, we can't do anything so return
         if self.equity_data is None or self.volatility_data is None:
-            messagebox.error("Error", "No IV Data is Avaliable for Analysis")
+            messagebox.showerror("Error", "No IV Data is Avaliable for Analysis")
             return
         
+        key = self.cache_key("analysis")
+
+        # Same data, same parameters and it's already on the canvas -> nothing to recompute or redraw
+        if key == self.drawn_key:
+            self.log_message(f"Analysis for {self.current_symbol} is up to date -> nothing to recompute")
+            return
+
         # Log the start of the analysis
         self.log_message("Analyzing IV Data...")
 
-        # First we need a 30 day forward IV dataframe | we get this from the volatility dataframe with out IV values
-        # Okay so first we compute the rolling avg over each 30 day period and then shift it back 30 days
-        # This makes the avg at index 0 the avg IV over the next 30 days so it makes it forward looking in sense
-        forward_vol_30d = self.volatility_data['implied_vol'].rolling(window=30, min_periods=1).mean().shift(-30)
+        results = self.cache.get_or_compute(key, lambda: analysis.run_regressions(self.volatility_data, self.bar_size), symbol=self.current_symbol)
 
-        # Okay now from all of this data, we are going to make an analysis dataframe
-        # The whole point of this is to match up the future data with the current data and see if there is any explanatory power there
-        analysis_df = pd.DataFrame({
-            "current_vol": self.volatility_data['implied_vol'],
-            "forward_30d_vol": forward_vol_30d,
-            "vol_diff": forward_vol_30d - self.volatility_data['implied_vol'],           # This works because we did min_periods=1 so we don't populate the first 0-29 indices with NaN
-            "vol_percentile": self.volatility_data['iv_percentile']
-        })
+        # If we have insufficient data, log it and return -> if we have less than 30 points, we have nothing to regress
+        if results is None:
+            self.log_message("Insufficient IV Data for Analysis")
+            return
 
-        analysis_df = analysis_df.dropna()
+        self.draw_results(results)
+        self.drawn_key = key
 
-        # If we have insufficient data, log it and return -> if len of analysis df is less than 30, we have nothing to regress
-        if len(analysis_df) < 30:
-            self.log_message("Insufficient IV Data for Analysis")
+        # Log Everything
+        for line in analysis.analysis_log_lines(results):
+            self.log_message(line)
+
+        for line in self.regime_engine.summary_lines(self.regime_stats, unit="days", bars_per_unit=bars.bars_per_day(self.bar_size)):
+            self.log_message(line)
+
+        self.analysis_results = results
+        self.save_current_session()
+
+    def draw_results(self, results):
+        """ Draws the analysis panels, with the IV time series coming from the pyramid level that fits the plot width. """
+
+        index = self.volatility_data.index
+        _, iv_series = self.iv_pyramid.view(index[0], index[-1], max(int(self.ax3.bbox.width), 1))
+
+        self.iv_line = analysis.draw_analysis(self.fig, self.ax1, self.ax2, self.ax3, self.volatility_data, results,
+                                              self.current_implied_vol, regime_engine=self.regime_engine,
+                                              regime_stats=self.regime_stats, iv_series=iv_series)
+
+        # Clearing the axes drops its callbacks, so hook the zoom handler back up after every redraw
+        self.ax3.callbacks.connect("xlim_changed", self.on_time_series_zoom)
+
+        # Update canvas
+        self.canvas.draw()
+
+    def on_time_series_zoom(self, ax):
+        """ Swaps the IV line to the pyramid level that gives about one point per pixel for the new x range. """
+
+        if self.iv_pyramid is None or self.iv_line is None:
             return
-        
-        # x = current_vol & y = forward_vol and try to see if there is some slope and intercept values that can explain the situation
-        slope1, intercept1, r1, p1, std_err1 = stats.linregress(
-            analysis_df['current_vol'], analysis_df['forward_30d_vol']
-        )
-
-        # x = current_vol & y = diff between forward and current vol | try to see if some slope and intercept can give us diff between current and forward vol
-        slope2, intercept2, r2, p2, std_err2 = stats.linregress(
-            analysis_df['current_vol'], analysis_df['vol_diff']
-        )
-
-        # Now we are trying to find a breakpoint to split regimes between high and low vol
-        if slope1 != 1:
-            x_intersection = intercept1/(1-slope1)
+
+        _, iv_series = self.iv_pyramid.view_for_axes(ax)
+        self.iv_line.set_data(iv_series.index, iv_series.to_numpy())
+        self.canvas.draw_idle()
+
+    def set_data_status(self, stale, saved_at=None):
+        """ Marks the data on screen as live or as a stale copy restored from the last session. """
+
+        self.stale_saved_at = saved_at if stale else None
+
+        if stale:
+            self.data_status_label.config(text=f"STALE (Saved {saved_at})", foreground="orange")
+            self.fig.suptitle(f"Restored Session From {saved_at} - Stale Until Refreshed From IB", fontsize=7, color="orange")
         else:
-            x_intersection = analysis_df['current_vol'].median()        # If slope is 1 which means regress line is equal to y=x, then our regime split will be at the median IV value
-        
-        # Whereever the condition is true, high_vol_regime will store a True value so high and low vol regime dfs are storing boolean values
-        high_vol_regime = analysis_df['current_vol'] > x_intersection       # Rmr x values are current vol values so if they are greater than intersection between y=x, that means every x value current vol results in a higher forward vol
-        low_vol_regime = analysis_df['current_vol'] <= x_intersection
-
-        # Do the regression for high vol regime
-        if high_vol_regime.sum() > 10:      # If there are more than 10 True values essentially cause True is 1 as an int
-            slope_high, intercept_high, r_high, p_high, std_err_high = stats.linregress(
-                analysis_df.loc[high_vol_regime, 'current_vol'], analysis_df.loc[high_vol_regime, 'vol_diff']       # Basically filters the columns to only have values where high vol is True
-            )
+            self.data_status_label.config(text="LIVE", foreground="green")
+            self.fig.suptitle("")
+
+    def save_current_session(self):
+        """ Persists what is on screen so the next launch can show it instantly. """
+
+        if self.volatility_data is None or self.current_symbol is None:
+            return
+
+        # Still showing the restored copy -> the file already holds exactly this, and re-saving would stamp old data with now
+        if self.stale_saved_at is not None:
+            return
+
+        try:
+            save_session(self.session_path, self.current_symbol, self.current_range, self.volatility_data,
+                         self.vol_annualization, results=self.analysis_results, regime_stats=self.regime_stats,
+                         bar_size=self.bar_size)
+        except Exception as e:
+            self.log_message(f"Session Save Error: {e}")
+
+    def restore_session(self):
+        """ Puts the last saved session on screen, marked stale. Returns False if there was nothing to restore. """
+
+        session = load_session(self.session_path)
+        if session is None:
+            return False
+
+        self.current_symbol = session["symbol"]
+        self.current_range = session["iv_range"]
+        self.symbol_var.set(self.current_symbol)
+        self.iv_range_var.set(self.current_range)
+        self.bar_size = session["bar_size"]
+        self.bar_size_var.set(self.bar_size)
+        self.vol_annualization = session["vol_annualization"]
+
+        # There are no raw bars in a restored session, so the processed series stands in for the equity data
+        self.volatility_data = session["volatility_data"]
+        self.equity_data = self.volatility_data.copy()
+        self.current_implied_vol = self.volatility_data['implied_vol'].iloc[-1] if len(self.volatility_data) > 0 else None
+
+        # Regime state comes back as saved; only the durations are recomputed from the codes
+        regime_arrays = session["regime_arrays"]
+        if regime_arrays is not None:
+            self.regime_stats = dict(regime_arrays, durations=self.regime_engine.durations(regime_arrays["codes"]))
         else:
-            slope_high = intercept_high = r_high = p_high = std_err_high = None
+            self.regime_stats = self.regime_engine.analyze(self.volatility_data['iv_percentile'].to_numpy())
+
+        self.iv_pyramid = bars.IVPyramid(self.volatility_data['implied_vol'], self.bar_size)
+
+        self.update_current_vol_display()
+        self.update_alerts(self.current_symbol)
 
-        # Same thing for low vol regime
-        if low_vol_regime.sum() > 10:
-            slope_low, intercept_low, r_low, p_low, std_err_low = stats.linregress(
-                analysis_df.loc[low_vol_regime, 'current_vol'], analysis_df.loc[low_vol_regime, 'vol_diff']
-            )
+        # The frames behind the plots aren't saved, they're cheap to rebuild from the series
+        self.analysis_results = analysis.run_regressions(self.volatility_data, self.bar_size)
+        self.set_data_status(stale=True, saved_at=session["saved_at"])
+
+        if self.analysis_results is not None:
+            self.draw_results(self.analysis_results)
         else:
-            slope_low = intercept_low = r_low = p_low = std_err_low = None
+            self.canvas.draw()
 
+        self.log_message(f"Restored {self.current_symbol} ({self.current_range}) session saved {session['saved_at']} -> data is stale until refreshed")
 
-        # Clear all of the subplots for graphing purposes
-        self.ax1.clear()
-        self.ax2.clear()
-        self.ax3.clear()
+        return True
 
-        # Just added this
-        self.fig.subplots_adjust(left=0.06, right=0.98, top=0.92, bottom=0.12, wspace=0.3)
+    def log_first_screen(self):
+        self.log_message(f"First screen ready in {time.perf_counter() - self.launch_started:.2f}s")
+
+    def start_background_refresh(self, symbol, vol_range):
+        """
+        Connects to IB and re-queries the restored symbol on a background thread so the UI stays usable meanwhile.
 
-        self.ax1.scatter(analysis_df["current_vol"], analysis_df['forward_30d_vol'], alpha=0.6, s=20)
+        The thread never touches tkinter; it posts its progress to a queue that the UI thread polls with root.after.
+        """
 
-        x_range = np.linspace(analysis_df['current_vol'].min(), analysis_df['current_vol'].max(), 100)  # 100 points for x range
-        y_pred1 = slope1 * x_range + intercept1 
-        self.ax1.plot(x_range, y_pred1, "r-", linewidth=2, label=f"Regression R^2 = {r1**2: .3f}")
+        host = self.host_var.get()
+        port = int(self.port_var.get())
+        bar_size = self.bar_size
+        updates = queue.Queue()
 
-        # Need to plot the y=x line
-        min_val = min(analysis_df['current_vol'].min(), analysis_df['forward_30d_vol'].min())
-        max_val = max(analysis_df['current_vol'].max(), analysis_df['forward_30d_vol'].max())
-        self.ax1.plot([min_val, max_val], [min_val, max_val], "k--", linewidth=1, alpha=.7, label="y=x (No Change)")    # The point of this line is a reference, if the current IV is equal to the 30day forward IV, there is no change
+        # Don't let the user start a second connection while this one is in progress
+        self.connect_btn.config(state="disabled")
+        self.log_message(f"Refreshing {symbol} in the background from IB at {host}:{port}...")
 
-        self.ax1.set_xlabel("Current IV", fontsize=5)
-        self.ax1.set_ylabel("30-D Forward Avg IV", fontsize=5)
-        self.ax1.set_title(f"Forward IV vs. Current IV", fontsize=5)
-        self.ax1.legend(fontsize=5)
-        self.ax1.grid(True, alpha=.3)
-        self.ax1.tick_params(labelsize=5)
+        def refresh_thread():
+            try:
+                self.ib_app.connect(host, port, clientId=43)
+                threading.Thread(target=self.ib_app.run, daemon=True).start()
 
+                for _ in range(100):
+                    if self.ib_app.connected:
+                        break
+                    time.sleep(0.1)
 
-        """ Onto the Second Chart Now """
+                if not self.ib_app.connected:
+                    updates.put(("failed", "Failed to Connect to IB TWS"))
+                    return
 
-        self.ax2.scatter(analysis_df.loc[high_vol_regime, 'current_vol'], analysis_df.loc[high_vol_regime, 'vol_diff'],
-                         alpha=.6, s=20, color='red', label='High Vol Regime')
-        
-        self.ax2.scatter(analysis_df.loc[low_vol_regime, 'current_vol'], analysis_df.loc[low_vol_regime, 'vol_diff'],
-                         alpha=.6, s=20, color='blue', label='Low Vol Regime')
-
-        # If high regression executed
-        if slope_high is not None:
-            x_high = np.linspace(analysis_df.loc[high_vol_regime, 'current_vol'].min(), 
-                                 analysis_df.loc[high_vol_regime, 'current_vol'].max(), 100)
-            y_pred_high = slope_high*x_high + intercept_high
-            self.ax2.plot(x_high, y_pred_high, "r-", linewidth=2, label=f"High Regime R^2 = {r_high**2: .3f}")
-
-        if slope_low is not None:
-            x_low = np.linspace(analysis_df.loc[low_vol_regime, 'current_vol'].min(), 
-                                 analysis_df.loc[low_vol_regime, 'current_vol'].max(), 100)
-            y_pred_low = slope_low*x_low + intercept_low
-            self.ax2.plot(x_low, y_pred_low, "b-", linewidth=2, label=f"Low Regime R^2 = {r_low**2: .3f}")
-
-
-        # Rmr our no change for the unconditional regression was the y=x line. Now our y-value is the difference between current vol and forward vol. Now if the diff is 0, this is equal to our unconditional y=x line
-        # Since our y value for ax2 is the diff, if that diff is 0, meaning y=0 horizontal line is our no change line where current vol = forward vol
-        self.ax2.axhline(y=0, color="k", linestyle='--', linewidth=1, alpha=.7, label="No Change (y=0)")
-
-        # Place a vertical x line at the point of intersection on the unconditional regression
-        self.ax2.axvline(x=x_intersection, color="k", linestyle="--", linewidth=1, alpha=.7,
-                         label=f"Regime Split (Vol = {x_intersection: .3f})")
-        
-        self.ax2.set_xlabel('Current Implied Volatility', fontsize=5)
-        self.ax2.set_ylabel('Vol Diff (F - C)', fontsize=5)
-        self.ax2.set_title('Vol Diff vs Current Vol (Regime Analysis)', fontsize=5)
-        self.ax2.legend(fontsize=5, loc='best')
-        self.ax2.grid(True, alpha=0.3)
-        self.ax2.tick_params(labelsize=5)
+                updates.put(("connected", None))
+                updates.put(("data", self.fetch_history(symbol, vol_range, bar_size)))
 
+            except Exception as e:
+                updates.put(("failed", f"Connect Error: {e}"))
 
-        """ Code for the Third Graph Starts Here """
+        threading.Thread(target=refresh_thread, daemon=True).start()
+        self.root.after(100, self.poll_background_refresh, updates, symbol, vol_range, bar_size)
 
-        # This is the graph for showing IV overtime
-        self.ax3.plot(self.volatility_data.index, self.volatility_data['implied_vol'], 
-                     label='Implied Volatility', linewidth=1)
-        
-        # Add regime bands
-        vol_75th = self.volatility_data['implied_vol'].quantile(0.75)
-        vol_25th = self.volatility_data['implied_vol'].quantile(0.25)
-        
-        # Add horizontal lines for seeing the percentiles
-        self.ax3.axhline(y=vol_75th, color='red', linestyle='--', alpha=0.7, label='75th Percentile')
-        self.ax3.axhline(y=vol_25th, color='green', linestyle='--', alpha=0.7, label='25th Percentile')
-        self.ax3.axhline(y=self.volatility_data['implied_vol'].mean(), color='black', linestyle='-', alpha=0.7, label='Mean')
+    def poll_background_refresh(self, updates, symbol, vol_range, bar_size):
+        """ Applies whatever the background refresh has posted so far, and reschedules itself until it's done. """
 
-        if self.current_implied_vol is not None:
-            self.ax3.scatter(self.volatility_data.index[-1], self.current_implied_vol, 
-                           color='red', s=100, zorder=5, label='Current')
-        
-        self.ax3.set_xlabel('Date', fontsize=5)
-        self.ax3.set_ylabel('IV', fontsize=5)
-        self.ax3.set_title('IV Time Series', fontsize=5)
-        self.ax3.legend(fontsize=5, loc='best')
-        self.ax3.grid(True, alpha=0.3)
-        
-        # Rotate x-axis labels for better readability
-        self.ax3.tick_params(axis='x', rotation=45, labelsize=3)
-        self.ax3.tick_params(axis='y', labelsize=5)
-        
-        # Update canvas
-        self.canvas.draw()
+        while True:
+            try:
+                kind, payload = updates.get_nowait()
+            except queue.Empty:
+                self.root.after(100, self.poll_background_refresh, updates, symbol, vol_range, bar_size)
+                return
 
-        # Log Everything
-        self.log_message(f"Regression 1 - Forward Vol on Current Vol:")
-        self.log_message(f"  Slope: {slope1:.4f}, Intercept: {intercept1:.4f}")
-        self.log_message(f"  R²: {r1**2:.4f}, P-value: {p1:.4f}")
-        self.log_message(f"  Intersection with y=x at Vol = {x_intersection:.4f}")
-        
-        self.log_message(f"Regression 2 - Vol Difference on Current Vol:")
-        self.log_message(f"  Slope: {slope2:.4f}, Intercept: {intercept2:.4f}")
-        self.log_message(f"  R²: {r2**2:.4f}, P-value: {p2:.4f}")
-        
-        self.log_message(f"Regime Analysis:")
-        if slope_high is not None:
-            self.log_message(f"  HIGH VOL regime (Vol > {x_intersection:.3f}):")
-            self.log_message(f"    Slope: {slope_high:.4f}, Intercept: {intercept_high:.4f}")
-            self.log_message(f"    R²: {r_high**2:.4f}, P-value: {p_high:.4f}")
-            self.log_message(f"    Data points: {high_vol_regime.sum()}")
-        else:
-            self.log_message(f"  HIGH VOL regime: Insufficient data for regression")
-            
-        if slope_low is not None:
-            self.log_message(f"  LOW VOL regime (Vol ≤ {x_intersection:.3f}):")
-            self.log_message(f"    Slope: {slope_low:.4f}, Intercept: {intercept_low:.4f}")
-            self.log_message(f"    R²: {r_low**2:.4f}, P-value: {p_low:.4f}")
-            self.log_message(f"    Data points: {low_vol_regime.sum()}")
-        else:
-            self.log_message(f"  LOW VOL regime: Insufficient data for regression")
-        
-        # Trading insights
-        if slope1 < 1:
-            self.log_message("INSIGHT: Forward volatility tends to mean-revert (slope < 1)")
-        else:
-            self.log_message("INSIGHT: Forward volatility tends to trend (slope > 1)")
-            
-        if slope2 < 0:
-            self.log_message("INSIGHT: High current volatility predicts lower future volatility (mean reversion)")
-        else:
-            self.log_message("INSIGHT: High current volatility predicts higher future volatility (momentum)")
\ No newline at end of file
+            if kind == "connected":
+                self.on_ib_connected()
+
+            elif kind == "data":
+                # The Query button is live once we're connected, so the user may have already replaced the restored session
+                # with something else (or refreshed it themselves); don't put the old symbol back over that
+                if (self.current_symbol, self.current_range, self.bar_size) != (symbol, vol_range, bar_size) or self.stale_saved_at is None:
+                    self.log_message(f"Background refresh of {symbol} dropped -> the screen has moved on since the restore")
+                    return
+
+                self.load_equity_data(symbol, vol_range, bar_size, payload)
+                if self.equity_data is not None:
+                    self.analyze_volatility()
+                    self.log_message(f"Live data ready in {time.perf_counter() - self.launch_started:.2f}s")
+                return
+
+            else:
+                self.connect_btn.config(state="normal")
+                self.log_message(f"{payload} -> still showing the stale session")
+                return
+
+    def on_close(self):
+        """ Window close -> save the session, stop alert delivery and drop the IB connection before exiting. """
+
+        self.save_current_session()
+        self.alert_engine.close()
+
+        if self.connected:
+            self.ib_app.disconnect()
+
+        self.root.destroy()
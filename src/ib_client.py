@@ -1,5 +1,21 @@
+import time
+import threading
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
+from ibapi.contract import Contract
+
+
+def create_equity_contract(symbol):
+    """ Builds the IB contract for a US equity so its data can be queried from the IB server. """
+
+    contract = Contract()
+    contract.symbol = symbol.upper()
+    contract.secType = "STK"    # Stock
+    contract.exchange = "SMART"
+    contract.currency = "USD"
+
+    return contract
+
 
 class IBApp(EClient, EWrapper):
 
@@ -10,6 +26,11 @@ class IBApp(EClient, EWrapper):
         self.historical_data = {}
         self.connected = False
 
+        # One event per outstanding request so callers can wait on their own reqID instead of polling a shared dict
+        self._request_done = {}
+        self._next_req_id = 1
+        self._req_lock = threading.Lock()
+
     def error(self, reqID, errorCode, errorString):
 
         """ This function is called by IB whenever there is an error in the code or with some request. """
@@ -19,6 +40,10 @@ class IBApp(EClient, EWrapper):
         
         print(f"Error {reqID} {errorCode} {errorString}")
 
+        # A request level error (e.g. no IV data for the symbol) means historicalDataEnd will never come, so release the waiter
+        if reqID in self._request_done:
+            self._request_done[reqID].set()
+
     def nextValidId(self, orderId):
         self.connected = True
         print("Connected to IB")
@@ -43,4 +68,73 @@ class IBApp(EClient, EWrapper):
     def historicalDataEnd(self, reqID, start, end):
         """ This is the function that IB calls when the request is finished. It is Optional. """
 
-        print(f"Historical Data has been recieved for reqID {reqID}")
\ No newline at end of file
+        print(f"Historical Data has been recieved for reqID {reqID}")
+
+        if reqID in self._request_done:
+            self._request_done[reqID].set()
+
+    def next_request_id(self):
+        """ Hands out a unique reqID so several requests can be in flight on the same connection. """
+
+        with self._req_lock:
+            req_id = self._next_req_id
+            self._next_req_id += 1
+        return req_id
+
+    def request_historical_iv(self, symbol, duration, bar_size="1 day", timeout=15):
+        """
+        Requests the implied volatility history for a symbol and blocks until IB has sent all of the bars (or the timeout hits).
+
+        Returns the list of bar dicts, which is empty if nothing came back in time. Safe to call from several threads at once.
+        """
+
+        req_id = self.next_request_id()
+        done = threading.Event()
+        self._request_done[req_id] = done
+
+        try:
+            self.reqHistoricalData(
+                reqId=req_id,
+                contract=create_equity_contract(symbol),
+                endDateTime="",
+                durationStr=duration,
+                barSizeSetting=bar_size,
+                whatToShow="OPTION_IMPLIED_VOLATILITY",
+                useRTH=1,
+                formatDate=1,
+                keepUpToDate=False,
+                chartOptions=[]
+            )
+
+            # If IB didn't finish in time, cancel so a half filled request doesn't keep streaming bars into our dict
+            if not done.wait(timeout):
+                self.cancelHistoricalData(req_id)
+
+            return self.historical_data.pop(req_id, [])
+
+        finally:
+            self._request_done.pop(req_id, None)
+
+
+def start_ib_app(host="127.0.0.1", port=7497, client_id=43, timeout=10):
+    """
+    Connects a fresh IBApp without any UI and runs its message loop on a daemon thread.
+
+    Returns the app once IB has sent nextValidId, or None if it never did within the timeout.
+    """
+
+    app = IBApp()
+    app.connect(host, port, clientId=client_id)
+
+    thread = threading.Thread(target=app.run, daemon=True)
+    thread.start()
+
+    deadline = time.time() + timeout
+    while not app.connected and time.time() < deadline:
+        time.sleep(0.1)
+
+    if not app.connected:
+        app.disconnect()
+        return None
+
+    return app
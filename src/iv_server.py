@@ -0,0 +1,621 @@
+import sys
+import json
+import time
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+from src import analysis, bars
+from src.cache import ResultCache
+from src.regimes import RegimeEngine
+
+"""
+Local IV data server. One process owns the IB connection (one client ID, one pacing budget) and serves the IV history,
+percentiles, regimes and streaming updates to any number of dashboards / notebooks on the same machine.
+
+    * Control channel -> multiprocessing.connection over a local socket with an auth key. Messages are small JSON dicts
+                         (requests, replies, update notifications); the arrays never go through it.
+    * Data channel    -> one shared memory ring buffer. The server writes each series into the ring once and every client
+                         copies it straight out of shared memory, so 20 clients on one symbol cost one write, not 20
+                         serializations.
+    * Coalescing      -> identical requests share one upstream fetch through the ResultCache Future, and the result is
+                         served from the ring for max_age seconds afterwards, so a burst of 20 identical requests is exactly
+                         one reqHistoricalData.
+    * Streaming       -> keys with subscribers are re-fetched every refresh_interval seconds using only a short tail of
+                         bars, merged into the history, and every subscriber is told where the new block is.
+
+IVClient has the same connect / run / disconnect / request_historical_iv interface as IBApp, so the report generator can use
+it in place of a direct TWS connection. The dashboard reads request_series instead, and uses the percentiles and regimes the
+server already computed rather than running the pipeline again.
+
+"""
+
+DEFAULT_SERVER_PORT = 7600
+DEFAULT_AUTHKEY = b"iv-dashboard"
+DEFAULT_RING_BYTES = 64 * 1024 * 1024
+
+# How much history a streaming refresh asks IB for; it only needs to overlap the last bars we already have
+REFRESH_DURATION = "2 D"
+
+# Arrays written for every series, in order: (name, dtype)
+SERIES_LAYOUT = (("dates", "<i8"), ("close", "<f8"), ("implied_vol", "<f8"), ("iv_percentile", "<f8"), ("regime", "i1"))
+
+
+class SharedRing():
+    """
+    Byte ring buffer in shared memory with one writer (the server) and any number of readers.
+
+    Positions are absolute byte counts that only ever grow, so the offset in the buffer is position % capacity and the
+    header's head tells readers how far the writer has got. The writer moves head past a block *before* writing it, which
+    means a reader can copy a block and then check head: if head has moved more than one lap past the block's start, the
+    block was (partly) overwritten while copying and the copy is thrown away.
+    """
+
+    HEADER_BYTES = 64
+
+    def __init__(self, name=None, capacity=DEFAULT_RING_BYTES):
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER_BYTES + capacity)
+            self.owner = True
+            _created_segments.add(self.shm.name)
+        else:
+            self.shm = _attach_shared_memory(name)
+            self.owner = False
+
+        self.name = self.shm.name
+        self._header = np.ndarray((2,), dtype=np.int64, buffer=self.shm.buf)     # [head, capacity]
+
+        if self.owner:
+            self._header[:] = (0, capacity)
+        self.capacity = int(self._header[1])
+
+        self._write_lock = threading.Lock()
+
+    def head(self):
+        return int(self._header[0])
+
+    def write(self, arrays):
+        """ Writes the arrays back to back (each padded to 8 bytes) as one block. Returns (position, length, offsets). """
+
+        sizes = [a.nbytes for a in arrays]
+        padded = [(size + 7) // 8 * 8 for size in sizes]
+        length = sum(padded)
+
+        if length > self.capacity:
+            raise ValueError(f"Series of {length} bytes does not fit in a {self.capacity} byte ring")
+
+        with self._write_lock:
+            position = self.head()
+
+            # Blocks never wrap around the end of the buffer; skip to the start of the next lap instead
+            if position % self.capacity + length > self.capacity:
+                position += self.capacity - position % self.capacity
+
+            self._header[0] = position + length
+
+            offset = self.HEADER_BYTES + position % self.capacity
+            offsets = []
+            for array, size, pad in zip(arrays, sizes, padded):
+                self.shm.buf[offset:offset + size] = np.ascontiguousarray(array).view(np.uint8).reshape(-1)
+                offsets.append(offset - self.HEADER_BYTES - position % self.capacity)
+                offset += pad
+
+        return position, length, offsets
+
+    def is_valid(self, position, length):
+        """ True while nothing has been written over the block yet. """
+
+        return self.head() <= position + self.capacity
+
+    def read(self, position, length):
+        """ Copies a block out of the ring. Returns None if it was overwritten before or during the copy. """
+
+        if not self.is_valid(position, length):
+            return None
+
+        start = self.HEADER_BYTES + position % self.capacity
+        block = bytes(self.shm.buf[start:start + length])
+
+        return block if self.is_valid(position, length) else None
+
+    def close(self):
+        del self._header
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Segments this process created; attaching to one of those (server and client in one process) must leave its tracking alone
+_created_segments = set()
+
+
+def _attach_shared_memory(name):
+    """ Attaches to the server's segment without letting this process's resource tracker unlink it when we exit. """
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    shm = shared_memory.SharedMemory(name=name)
+    if name not in _created_segments:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _send(conn, lock, message):
+    data = json.dumps(message).encode()
+    with lock:
+        conn.send_bytes(data)
+
+
+def _receive(conn):
+    return json.loads(conn.recv_bytes().decode())
+
+
+class IVServer():
+
+    def __init__(self, ib_app, address=("127.0.0.1", DEFAULT_SERVER_PORT), authkey=DEFAULT_AUTHKEY,
+                 ring_bytes=DEFAULT_RING_BYTES, max_age=60, refresh_interval=60, log=print):
+
+        self.ib_app = ib_app
+        self.address = address
+        self.authkey = authkey
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.log = log
+
+        self.ring = SharedRing(capacity=ring_bytes)
+        self.regime_engine = RegimeEngine()
+
+        # In flight fetches are shared through the cache; finished series live in entries and the ring
+        self.cache = ResultCache()
+        self.entries = {}           # (symbol, duration, bar_size) -> entry dict, see _publish
+        self.subscribers = {}       # key -> set of ids of the clients subscribed to it
+        self._handles = {}          # (key, client id) -> client connection + send lock, so the refresher can push to them
+        self._lock = threading.Lock()
+
+        self.upstream_fetches = 0
+        self.requests = 0
+        self.clients = 0
+
+        self._listener = None
+        self.ready = threading.Event()      # Set once the listener is up and address holds the real port
+        self._stopped = threading.Event()
+
+    def serve_forever(self):
+        """ Accepts clients until close() is called. Each client gets its own thread (and each IB bound request another); the refresher runs on one more. """
+
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self.address = self._listener.address        # Resolves port 0 to the port actually picked
+        self.ready.set()
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+        self.log(f"IV server listening on {self.address[0]}:{self.address[1]} (ring {self.ring.name}, {self.ring.capacity / (1024 * 1024):.0f} MB)")
+
+        while not self._stopped.is_set():
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                break
+            except Exception as e:
+                # Bad auth key or a client that hung up mid handshake; keep serving everyone else
+                self.log(f"IV Server Accept Error: {e}")
+                continue
+
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn):
+        client = {"conn": conn, "lock": threading.Lock()}
+        subscribed = set()
+
+        with self._lock:
+            self.clients += 1
+
+        try:
+            while True:
+                try:
+                    message = _receive(conn)
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    reply = self._handle(message, client, subscribed)
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+
+                # history / subscribe hand back a callable since they can wait seconds on IB -> run it on its own thread, so
+                # one client asking for several symbols at once gets them fetched side by side (replies carry the request id)
+                if callable(reply):
+                    threading.Thread(target=self._reply, args=(client, message, reply), daemon=True).start()
+                else:
+                    self._reply(client, message, lambda: reply)
+
+        finally:
+            with self._lock:
+                self.clients -= 1
+                for key in subscribed:
+                    self.subscribers.get(key, set()).discard(id(client))
+                    if not self.subscribers.get(key):
+                        self.subscribers.pop(key, None)
+                    self._handles.pop((key, id(client)), None)
+            conn.close()
+
+    def _reply(self, client, message, respond):
+        try:
+            reply = respond()
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+
+        reply["id"] = message.get("id")
+        try:
+            _send(client["conn"], client["lock"], reply)
+        except (OSError, ValueError):
+            pass        # The client hung up while its request was in flight
+
+    def _handle(self, message, client, subscribed):
+        """
+        Quick ops return their reply. history / subscribe return a callable producing it, after doing any bookkeeping here on
+        the client's own thread, so subscribe / unsubscribe are still applied in the order the client sent them.
+        """
+
+        op = message.get("op")
+
+        if op == "hello":
+            return {"ok": True, "ring": self.ring.name, "capacity": self.ring.capacity}
+
+        if op == "stats":
+            with self._lock:
+                return {"ok": True, "upstream_fetches": self.upstream_fetches, "requests": self.requests,
+                        "clients": self.clients, "series": len(self.entries),
+                        "subscriptions": sum(len(s) for s in self.subscribers.values())}
+
+        key = (message["symbol"].upper(), message["duration"], message.get("bar_size", "1 day"))
+
+        if op == "history":
+            with self._lock:
+                self.requests += 1
+            return lambda: self._block_reply(self.get_entry(key))
+
+        if op == "subscribe":
+            with self._lock:
+                self.subscribers.setdefault(key, set()).add(id(client))
+                self._handles[(key, id(client))] = client
+            subscribed.add(key)
+            return lambda: self._block_reply(self.get_entry(key))
+
+        if op == "unsubscribe":
+            with self._lock:
+                self.subscribers.get(key, set()).discard(id(client))
+                if not self.subscribers.get(key):
+                    self.subscribers.pop(key, None)
+                self._handles.pop((key, id(client)), None)
+            subscribed.discard(key)
+            return {"ok": True}
+
+        return {"ok": False, "error": f"Unknown op {op}"}
+
+    def get_entry(self, key):
+        """ The published entry for key, fetching it from IB (once, however many clients are asking) if it's missing or old. """
+
+        entry = self._fresh_entry(key)
+        if entry is not None:
+            return entry
+
+        # Between the check above and here the fetch someone else owned may have published and finished, so whoever ends up
+        # owning the compute checks again before going to IB
+        return self.cache.get_or_compute(("fetch",) + key, lambda: self._fresh_entry(key) or self._fetch(key), store=False)
+
+    def _fresh_entry(self, key):
+        """ The entry for key if it can still be served without asking IB, otherwise None. """
+
+        with self._lock:
+            entry = self.entries.get(key)
+            fresh = entry is not None and self._is_fresh(key, entry, time.time())
+
+        if not fresh:
+            return None
+
+        # Still in the ring -> serve it; lapped by newer blocks -> write the same data again, no need to ask IB
+        if self.ring.is_valid(entry["position"], entry["length"]):
+            return entry
+        return self._publish(key, entry["close"], entry["fetched_at"])
+
+    def _is_fresh(self, key, entry, now):
+        # Subscribed keys are kept current by the refresher, everything else is good for max_age seconds
+        return key in self.subscribers or now - entry["fetched_at"] < self.max_age
+
+    def _prune(self):
+        """ Drops entries that would be re-fetched on their next request anyway, so the server doesn't keep every history it has served. """
+
+        now = time.time()
+        for key in [k for k, entry in self.entries.items() if not self._is_fresh(k, entry, now)]:
+            del self.entries[key]
+
+    def _fetch(self, key):
+        symbol, full_duration, bar_size = key
+
+        with self._lock:
+            self.upstream_fetches += 1
+
+        data = self.ib_app.request_historical_iv(symbol, full_duration, bar_size=bar_size)
+        if not data:
+            return None
+
+        return self._publish(key, analysis.bars_to_frame(data)['close'], time.time())
+
+    def _publish(self, key, close, fetched_at):
+        """ Runs the IV pipeline on the closes, writes the series into the ring and records where it went. """
+
+        symbol, duration, bar_size = key
+
+        volatility_data = analysis.process_implied_volatility(close.to_frame("close"), bars.vol_annualization(bar_size), bar_size)
+        percentile = volatility_data['iv_percentile'].to_numpy()
+        codes = self.regime_engine.classify(percentile)
+
+        arrays = [
+            close.index.values.astype("datetime64[ns]").astype(np.int64),
+            close.to_numpy(dtype=np.float64),
+            volatility_data['implied_vol'].to_numpy(dtype=np.float64),
+            percentile.astype(np.float64),
+            codes.astype(np.int8),
+        ]
+        position, length, offsets = self.ring.write(arrays)
+
+        entry = {
+            "close": close,
+            "fetched_at": fetched_at,
+            "position": position,
+            "length": length,
+            "offsets": offsets,
+            "points": len(close),
+            "regime": self.regime_engine.label(codes[-1]) if len(codes) else None,
+        }
+
+        with self._lock:
+            self.entries[key] = entry
+            self._prune()
+
+        return entry
+
+    def _block_reply(self, entry):
+        if entry is None:
+            return {"ok": True, "points": 0}
+
+        return {"ok": True, "points": entry["points"], "position": entry["position"], "length": entry["length"],
+                "offsets": entry["offsets"], "fetched_at": entry["fetched_at"], "regime": entry["regime"]}
+
+    def _refresh_loop(self):
+        """ Keeps subscribed keys current: one short tail fetch per key, merged in, then pushed to every subscriber. """
+
+        while not self._stopped.wait(self.refresh_interval):
+            with self._lock:
+                self._prune()
+                keys = list(self.subscribers)
+
+            for key in keys:
+                try:
+                    self.refresh(key)
+                except Exception as e:
+                    self.log(f"IV Server Refresh Error {key}: {e}")
+
+    def refresh(self, key):
+        """ Fetches the latest bars for a key and notifies its subscribers if anything changed. """
+
+        with self._lock:
+            entry = self.entries.get(key)
+
+        if entry is None:
+            return
+
+        with self._lock:
+            self.upstream_fetches += 1
+
+        symbol, _, bar_size = key
+        data = self.ib_app.request_historical_iv(symbol, REFRESH_DURATION, bar_size=bar_size)
+        if not data:
+            return
+
+        # New bars replace any overlapping ones (the last bar of the day keeps updating until the close)
+        tail = analysis.bars_to_frame(data)['close']
+        merged = pd.concat([entry["close"], tail])
+        merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+        if len(merged) == len(entry["close"]) and merged.iloc[-1] == entry["close"].iloc[-1]:
+            return
+
+        update = self._block_reply(self._publish(key, merged, time.time()))
+        update.update({"event": "update", "key": list(key)})
+
+        with self._lock:
+            clients = [self._handles[(key, c)] for c in self.subscribers.get(key, ()) if (key, c) in self._handles]
+
+        for client in clients:
+            try:
+                _send(client["conn"], client["lock"], update)
+            except (OSError, ValueError):
+                pass        # That client is going away; its thread cleans up the subscription
+
+    def close(self):
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.close()
+        self.ring.close()
+
+
+class IVClient():
+    """
+    Connection to an IVServer. Looks like IBApp to the code using it: connect(), run() on a thread, connected,
+    request_historical_iv() and disconnect(), so it can be swapped in for a direct TWS connection. request_series() and
+    subscribe() hand over the processed series as a dataframe.
+    """
+
+    def __init__(self, authkey=DEFAULT_AUTHKEY):
+        self.authkey = authkey
+        self.connected = False
+
+        self.conn = None
+        self.ring = None
+        self._send_lock = threading.Lock()
+        self._pending = {}          # request id -> Future waiting on the reply
+        self._callbacks = {}        # (symbol, duration, bar_size) -> update callback
+        self._next_id = 1
+        self._id_lock = threading.Lock()
+
+    def connect(self, host, port, clientId=None):
+        """ clientId is accepted for IBApp compatibility and ignored; the server holds the only IB client ID. """
+
+        self.conn = Client((host, port), authkey=self.authkey)
+        _send(self.conn, self._send_lock, {"op": "hello"})
+        hello = _receive(self.conn)
+
+        self.ring = SharedRing(name=hello["ring"])
+        self.connected = True
+
+    def run(self):
+        """ Reads replies and pushed updates until the connection drops. Blocks, like EClient.run. """
+
+        try:
+            while True:
+                message = _receive(self.conn)
+
+                if message.get("event") == "update":
+                    key = tuple(message["key"])
+                    callback = self._callbacks.get(key)
+                    if callback is None:
+                        continue
+
+                    # Can't ask the server for a lapped block again from here (this thread reads the reply), so skip it;
+                    # the next refresh that changes anything brings the whole series again
+                    arrays = self._read_series(message)
+                    if arrays is None:
+                        print(f"IV Update for {key} was overwritten in the ring before it could be read")
+                        continue
+
+                    try:
+                        callback(*key, _series_frame(arrays))
+                    except Exception as e:
+                        print(f"IV Update Callback Error: {e}")
+                    continue
+
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None:
+                    future.set_result(message)
+
+        except (EOFError, OSError):
+            pass
+
+        finally:
+            self.connected = False
+            for future in list(self._pending.values()):
+                future.set_exception(ConnectionError("IV server connection closed"))
+            self._pending.clear()
+
+    def _call(self, message, timeout):
+        with self._id_lock:
+            message["id"] = self._next_id
+            self._next_id += 1
+
+        future = self._pending[message["id"]] = Future()
+        _send(self.conn, self._send_lock, message)
+
+        try:
+            reply = future.result(timeout)
+        finally:
+            self._pending.pop(message["id"], None)
+
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "IV server request failed"))
+        return reply
+
+    def _read_series(self, reply):
+        """ Copies a series block out of the ring into arrays. None if it was lapped before we got to it. """
+
+        if not reply.get("points"):
+            return {}
+
+        block = self.ring.read(reply["position"], reply["length"])
+        if block is None:
+            return None
+
+        n = reply["points"]
+        return {name: np.frombuffer(block, dtype=dtype, count=n, offset=offset)
+                for (name, dtype), offset in zip(SERIES_LAYOUT, reply["offsets"])}
+
+    def request_series(self, symbol, duration, bar_size="1 day", timeout=15):
+        """
+        IV history for a symbol as a dataframe indexed by date with close, implied_vol, iv_percentile and regime (code)
+        columns, all computed once on the server. Empty dataframe if IB had no data.
+        """
+
+        for _ in range(3):
+            reply = self._call({"op": "history", "symbol": symbol, "duration": duration, "bar_size": bar_size}, timeout)
+            arrays = self._read_series(reply)
+
+            # A lapped block means the ring wrapped between the reply and our copy; asking again makes the server rewrite it
+            if arrays is not None:
+                return _series_frame(arrays)
+
+        raise RuntimeError(f"IV series for {symbol} kept getting overwritten in the ring; increase the server's ring size")
+
+    def request_historical_iv(self, symbol, duration, bar_size="1 day", timeout=15):
+        """ Same return value as IBApp.request_historical_iv, except the bar dicts only carry date and close (all the IV pipeline reads). """
+
+        return _frame_bars(self.request_series(symbol, duration, bar_size, timeout))
+
+    def subscribe(self, symbol, duration, bar_size, callback, timeout=15):
+        """
+        Streams updates for a key. callback(symbol, duration, bar_size, series) is called on the client's run() thread with
+        the full series (same dataframe as request_series) every time the server sees new bars, so it must not touch tkinter
+        directly.
+        """
+
+        key = (symbol.upper(), duration, bar_size)
+        self._callbacks[key] = callback
+        self._call({"op": "subscribe", "symbol": symbol, "duration": duration, "bar_size": bar_size}, timeout)
+
+    def unsubscribe(self, symbol, duration, bar_size, timeout=15):
+        key = (symbol.upper(), duration, bar_size)
+        self._callbacks.pop(key, None)
+        self._call({"op": "unsubscribe", "symbol": symbol, "duration": duration, "bar_size": bar_size}, timeout)
+
+    def stats(self, timeout=15):
+        return self._call({"op": "stats"}, timeout)
+
+    def disconnect(self):
+        self.connected = False
+        self._callbacks.clear()
+
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+def _series_frame(arrays):
+    if not arrays:
+        return pd.DataFrame(columns=[name for name, _ in SERIES_LAYOUT[1:]])
+
+    index = pd.DatetimeIndex(arrays["dates"].astype("datetime64[ns]"), name="date")
+    return pd.DataFrame({name: arrays[name] for name, _ in SERIES_LAYOUT[1:]}, index=index)
+
+
+def _frame_bars(series):
+    dates = series.index.strftime("%Y%m%d %H:%M:%S")
+    return [{"date": date, "close": close} for date, close in zip(dates, series['close'].tolist())]
+
+
+def start_iv_client(host="127.0.0.1", port=DEFAULT_SERVER_PORT, authkey=DEFAULT_AUTHKEY):
+    """ Connects to a running IVServer and starts the client's reader thread. Returns None if no server answered. """
+
+    client = IVClient(authkey)
+    try:
+        client.connect(host, port)
+    except (OSError, EOFError) as e:
+        print(f"Could not reach the IV server at {host}:{port}: {e}")
+        return None
+
+    threading.Thread(target=client.run, daemon=True).start()
+    return client
@@ -0,0 +1,246 @@
+import numpy as np
+from bisect import bisect_left
+
+"""
+Regime engine. Classifies a whole IV percentile history (or a 2D symbols x bars block of them) in one np.digitize call and
+derives everything else from the integer regime codes with array ops: run lengths, the empirical transition matrix and the
+expected number of bars before IV reverts back to the normal regime.
+
+"""
+
+# Percentile edges between regimes -> (x <= 0.2) LOW, (0.2, 0.4] BELOW AVG, (0.4, 0.6] NORMAL, (0.6, 0.8] ABOVE AVG, (x > 0.8) HIGH
+REGIME_EDGES = (0.2, 0.4, 0.6, 0.8)
+REGIME_LABELS = ("LOW IV", "BELOW AVG IV", "NORMAL VOL", "ABOVE AVG IV", "HIGH IV")
+
+# Label colors are Tk color names for the dashboard, band colors are matplotlib colors for shading ax3 (None = don't shade)
+REGIME_COLORS = ("green", "deep sky blue", "black", "orange", "red")
+REGIME_BAND_COLORS = ("green", "deepskyblue", None, "orange", "red")
+
+# Code given to bars we can't classify yet (NaN percentile, e.g. the first year before the rolling window fills)
+UNCLASSIFIED = -1
+
+
+class RegimeEngine():
+
+    def __init__(self, edges=REGIME_EDGES, labels=REGIME_LABELS, colors=REGIME_COLORS, band_colors=REGIME_BAND_COLORS, neutral=None):
+
+        if len(labels) != len(edges) + 1:
+            raise ValueError("Need exactly one more regime label than regime edges")
+
+        self.edges = np.asarray(edges, dtype=float)
+        self._edge_list = [float(edge) for edge in edges]
+        self.labels = tuple(labels)
+        self.colors = tuple(colors)
+        self.band_colors = tuple(band_colors)
+
+        # The regime IV reverts to; defaults to the middle one
+        self.neutral = len(labels) // 2 if neutral is None else neutral
+
+    @property
+    def n_regimes(self):
+        return len(self.labels)
+
+    def classify(self, percentiles):
+        """ Maps percentiles of any shape to int8 regime codes in a single vectorized step. NaNs come back as UNCLASSIFIED. """
+
+        percentiles = np.asarray(percentiles, dtype=float)
+
+        # right=True so a value sitting exactly on an edge falls in the lower regime, same as the old > comparisons
+        codes = np.digitize(percentiles, self.edges, right=True)
+
+        return np.where(np.isnan(percentiles), UNCLASSIFIED, codes).astype(np.int8)
+
+    def classify_one(self, percentile):
+        """ Scalar version of classify for per tick callers, without the numpy call overhead. """
+
+        if percentile is None or percentile != percentile:
+            return UNCLASSIFIED
+
+        # Number of edges strictly below the value, which is exactly what digitize(right=True) returns
+        return bisect_left(self._edge_list, percentile)
+
+    def label(self, code):
+        return self.labels[code] if code != UNCLASSIFIED else "N/A"
+
+    def color(self, code):
+        return self.colors[code] if code != UNCLASSIFIED else "black"
+
+    def run_lengths(self, codes):
+        """
+        Run length encodes the regime codes along the last axis.
+
+        Returns (rows, starts, lengths, values) as flat arrays, one entry per run. For 2D input the runs never cross from one
+        symbol's row into the next; for 1D input rows is all zeros.
+        """
+
+        codes = np.atleast_2d(codes)
+        n_rows, n_bars = codes.shape
+
+        if n_bars == 0:
+            empty = np.array([], dtype=np.intp)
+            return empty, empty, empty, np.array([], dtype=codes.dtype)
+
+        # A new run starts wherever the code changes, and always at the first bar of each row
+        is_start = np.ones(codes.shape, dtype=bool)
+        is_start[:, 1:] = codes[:, 1:] != codes[:, :-1]
+
+        flat_starts = np.flatnonzero(is_start)
+        flat_ends = np.append(flat_starts[1:], codes.size)
+
+        rows, starts = np.divmod(flat_starts, n_bars)
+        lengths = flat_ends - flat_starts
+        values = codes.ravel()[flat_starts]
+
+        return rows, starts, lengths, values
+
+    def durations(self, codes):
+        """ Mean and max run length (in bars) of every regime, ignoring unclassified runs. """
+
+        _, _, lengths, values = self.run_lengths(codes)
+
+        valid = values != UNCLASSIFIED
+        lengths, values = lengths[valid], values[valid]
+
+        counts = np.bincount(values, minlength=self.n_regimes)
+        totals = np.bincount(values, weights=lengths, minlength=self.n_regimes)
+
+        mean = np.full(self.n_regimes, np.nan)
+        np.divide(totals, counts, out=mean, where=counts > 0)
+
+        longest = np.zeros(self.n_regimes, dtype=np.intp)
+        np.maximum.at(longest, values, lengths)
+
+        return {"runs": counts, "mean": mean, "max": longest}
+
+    def transition_matrix(self, codes):
+        """
+        Empirical bar to bar regime transition matrix along the last axis.
+
+        Returns (probabilities, counts), both n_regimes x n_regimes with rows as the "from" regime. Rows with no observations
+        are left as NaN in the probabilities.
+        """
+
+        codes = np.atleast_2d(codes)
+        src = codes[:, :-1].ravel()
+        dst = codes[:, 1:].ravel()
+
+        valid = (src != UNCLASSIFIED) & (dst != UNCLASSIFIED)
+        k = self.n_regimes
+
+        counts = np.bincount(src[valid].astype(np.intp) * k + dst[valid], minlength=k * k).reshape(k, k)
+
+        row_totals = counts.sum(axis=1, keepdims=True)
+        probabilities = np.full((k, k), np.nan)
+        np.divide(counts, row_totals, out=probabilities, where=row_totals > 0)
+
+        return probabilities, counts
+
+    def expected_time_to_revert(self, probabilities):
+        """
+        Expected number of bars to first reach the neutral regime from each regime (mean first passage time of the chain).
+
+        Solves (I - Q) t = 1 where Q is the transition matrix restricted to the regimes that reach neutral with certainty.
+        Everything else comes back as inf: regimes never seen leaving, regimes with no path to neutral, and regimes that can
+        move into one of those (a chance of never reverting makes the expected time infinite).
+        """
+
+        k = self.n_regimes
+        times = np.full(k, np.inf)
+        times[self.neutral] = 0.0
+
+        # Neutral is where the walk stops, so its own moves don't count; unobserved rows (NaN) have no moves at all
+        moves = np.nan_to_num(probabilities, nan=0.0) > 0
+        moves[self.neutral] = False
+
+        # Regimes with some path to neutral (walking the moves backwards from it)
+        reaches = np.zeros(k, dtype=bool)
+        reaches[self.neutral] = True
+        for _ in range(k):
+            reaches |= (moves & reaches).any(axis=1)
+
+        # Regimes with some path to a regime that never reverts
+        doomed = ~reaches
+        for _ in range(k):
+            doomed |= (moves & doomed).any(axis=1)
+
+        solvable = np.flatnonzero(~doomed & (np.arange(k) != self.neutral))
+        if len(solvable) == 0:
+            return times
+
+        # Every move out of a solvable regime lands in another solvable regime or in neutral, so I - Q is non singular
+        Q = probabilities[np.ix_(solvable, solvable)]
+        times[solvable] = np.linalg.solve(np.eye(len(solvable)) - Q, np.ones(len(solvable)))
+
+        return times
+
+    def analyze(self, percentiles, codes=None):
+        """
+        Classifies the full history and bundles the codes with the duration, transition and reversion statistics. Pass codes
+        if the history was already classified (the IV server sends them along with the percentiles).
+        """
+
+        codes = self.classify(percentiles) if codes is None else np.asarray(codes, dtype=np.int8)
+        probabilities, counts = self.transition_matrix(codes)
+
+        return {
+            "codes": codes,
+            "durations": self.durations(codes),
+            "transition_matrix": probabilities,
+            "transition_counts": counts,
+            "time_to_revert": self.expected_time_to_revert(probabilities),
+        }
+
+    def shade(self, ax, index, codes, alpha=0.12):
+        """
+        Shades the background of ax behind every regime run with that regime's band color.
+
+        One broken_barh per regime holding a rectangle per run (from the run's first bar to the next run's first bar), drawn
+        in x-data / y-axes coordinates so it spans the full height whatever the y limits end up being. A long intraday
+        history costs as much to shade as it has regime changes, not bars.
+        """
+
+        codes = np.asarray(codes)
+        if len(codes) == 0:
+            return
+
+        # Dates -> matplotlib's numeric x so the run widths can be computed with plain subtraction
+        x = np.asarray(ax.convert_xunits(index), dtype=float)
+
+        _, starts, _, values = self.run_lengths(codes)
+        ends = np.append(starts[1:], len(codes) - 1)
+        left, width = x[starts], x[ends] - x[starts]
+
+        transform = ax.get_xaxis_transform()
+
+        for code, color in enumerate(self.band_colors):
+            if color is None:
+                continue
+
+            runs = values == code
+            if not runs.any():
+                continue
+
+            ax.broken_barh(list(zip(left[runs], width[runs])), (0, 1), transform=transform, facecolors=color, alpha=alpha,
+                           linewidth=0)
+
+    def summary_lines(self, stats, unit="bars", bars_per_unit=1):
+        """
+        The duration and reversion stats as the lines the dashboard logs to the status area. Everything is counted in bars;
+        bars_per_unit converts to the unit named (e.g. 7 hourly bars per day).
+        """
+
+        durations = stats["durations"]
+        lines = [f"Regime History ({unit}):"]
+
+        for code, label in enumerate(self.labels):
+            if durations["runs"][code] == 0:
+                lines.append(f"  {label}: never observed")
+                continue
+
+            revert = stats["time_to_revert"][code] / bars_per_unit
+            revert_text = "never reverts" if np.isinf(revert) else f"{revert:.1f}"
+
+            lines.append(f"  {label}: {durations['runs'][code]} runs | Mean Duration: {durations['mean'][code] / bars_per_unit:.1f} | "
+                         f"Longest: {durations['max'][code] / bars_per_unit:.1f} | Exp. Time to Revert: {revert_text}")
+
+        return lines
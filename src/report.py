@@ -0,0 +1,245 @@
+import os
+import html
+import time
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from src import analysis, bars
+from src.regimes import RegimeEngine
+
+"""
+Off-screen report mode. Runs the same query -> process -> analyze pipeline as the dashboard for a list of symbols, renders
+the three panels to PNGs with the Agg backend and writes one summary table with the regression stats and regimes.
+
+Fetching is IO bound so it runs on a few threads sharing the one IB connection, rendering is CPU bound so it goes to a
+process pool. Each worker builds its figure once in the initializer and just clears the axes for every symbol after that.
+
+"""
+
+# Per worker process figure, created once by _init_worker and reused for every symbol that worker renders
+_fig = None
+_axes = None
+_regime_engine = RegimeEngine()
+
+# IB starts pacing violations past ~50 simultaneous historical requests, so keep the fetch side well under that
+MAX_CONCURRENT_FETCHES = 6
+
+
+def _init_worker():
+    """ Runs once in every worker process. Using Figure + FigureCanvasAgg directly keeps pyplot (and Tk) out of the workers. """
+
+    global _fig, _axes
+
+    _fig = Figure(figsize=(20, 7))
+    FigureCanvasAgg(_fig)
+    _axes = _fig.subplots(1, 3)
+
+
+def _render_symbol(symbol, equity_data, out_dir, bar_size, dpi):
+    """ Processes, analyzes and renders one symbol on the worker's figure. Returns the summary row for that symbol. """
+
+    volatility_data = analysis.process_implied_volatility(equity_data, bars.vol_annualization(bar_size), bar_size)
+    current_implied_vol = volatility_data['implied_vol'].iloc[-1]
+    current_percentile = volatility_data['iv_percentile'].iloc[-1]
+    regime_stats = _regime_engine.analyze(volatility_data['iv_percentile'].to_numpy())
+    regime_code = regime_stats["codes"][-1]
+    per_day = bars.bars_per_day(bar_size)
+
+    row = {
+        "symbol": symbol,
+        "points": len(volatility_data),
+        "current_iv": current_implied_vol,
+        "percentile": current_percentile,
+        "regime": _regime_engine.label(regime_code),
+        "regime_duration": regime_stats["durations"]["mean"][regime_code] / per_day if regime_code >= 0 else None,
+        "time_to_revert": regime_stats["time_to_revert"][regime_code] / per_day if regime_code >= 0 else None,
+        "png": None,
+        "error": None,
+    }
+
+    results = analysis.run_regressions(volatility_data, bar_size)
+    if results is None:
+        row["error"] = "Insufficient IV Data for Analysis"
+        return row
+
+    ax1, ax2, ax3 = _axes
+    # Only one resolution fits a static image, so use the pyramid level for the full range at the rendered width
+    _, iv_series = bars.IVPyramid(volatility_data['implied_vol'], bar_size).view(
+        volatility_data.index[0], volatility_data.index[-1], max(int(ax3.bbox.width * dpi / _fig.dpi), 1))
+
+    analysis.draw_analysis(_fig, ax1, ax2, ax3, volatility_data, results, current_implied_vol,
+                           regime_engine=_regime_engine, regime_stats=regime_stats, iv_series=iv_series)
+    _fig.suptitle(f"{symbol} Implied Volatility", fontsize=8)
+
+    png_name = f"{symbol}.png"
+    _fig.savefig(os.path.join(out_dir, png_name), dpi=dpi)
+    row["png"] = png_name
+
+    row.update({
+        "slope1": results["slope1"],
+        "r2_1": results["r1"]**2,
+        "slope2": results["slope2"],
+        "r2_2": results["r2"]**2,
+        "x_intersection": results["x_intersection"],
+        "slope_high": results["slope_high"],
+        "r2_high": results["r_high"]**2 if results["r_high"] is not None else None,
+        "slope_low": results["slope_low"],
+        "r2_low": results["r_low"]**2 if results["r_low"] is not None else None,
+    })
+
+    return row
+
+
+def generate_reports(ib_app, symbols, duration="2 Y", out_dir="reports", bar_size="1 day",
+                     workers=None, summary_format="html", dpi=150, log=print):
+    """
+    Builds a PNG per symbol plus a summary table in out_dir and returns the path of the summary.
+
+    ib_app must already be connected (see start_ib_app). workers defaults to the number of cores.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    symbols = [s.upper() for s in symbols]
+    rows = []
+    start = time.time()
+
+    def fetch(symbol):
+        return analysis.bars_to_frame(ib_app.request_historical_iv(symbol, duration, bar_size=bar_size))
+
+    # Renders are submitted as soon as each fetch lands so the process pool is busy while IB is still sending the rest.
+    # Workers are spawned, not forked: the IB reader and fetch threads are running by now, and forking a threaded process
+    # can deadlock the child on a lock one of those threads held (_init_worker builds everything a worker needs anyway)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             mp_context=multiprocessing.get_context("spawn")) as pool, \
+         ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES) as fetchers:
+
+        renders = {}
+        fetches = {fetchers.submit(fetch, s): s for s in symbols}
+        for fetched in as_completed(fetches):
+            symbol = fetches[fetched]
+            try:
+                equity_data = fetched.result()
+            except Exception as e:
+                # A timeout or a dropped IB / IV server connection costs this symbol, not the whole report
+                log(f"{symbol}: Fetch Error: {e}")
+                rows.append({"symbol": symbol, "error": f"Fetch Error: {e}"})
+                continue
+
+            if equity_data is None:
+                log(f"No IV Data Recieved for {symbol}")
+                rows.append({"symbol": symbol, "error": "No IV Data Recieved"})
+                continue
+
+            renders[pool.submit(_render_symbol, symbol, equity_data, out_dir, bar_size, dpi)] = symbol
+
+        for done in as_completed(renders):
+            symbol = renders[done]
+            try:
+                row = done.result()
+            except Exception as e:
+                row = {"symbol": symbol, "error": f"Render Error: {e}"}
+
+            log(f"{symbol}: {row['error'] or row['regime']}")
+            rows.append(row)
+
+    # Keep the table in the order the symbols were asked for, not the order they finished in
+    order = {s: i for i, s in enumerate(symbols)}
+    rows.sort(key=lambda r: order[r["symbol"]])
+
+    if summary_format == "md":
+        summary_path = os.path.join(out_dir, "summary.md")
+        content = _markdown_summary(rows, duration, bar_size)
+    else:
+        summary_path = os.path.join(out_dir, "summary.html")
+        content = _html_summary(rows, duration, bar_size)
+
+    with open(summary_path, "w") as f:
+        f.write(content)
+
+    log(f"Wrote {len(rows)} symbol reports to {out_dir} in {time.time() - start:.1f}s")
+
+    return summary_path
+
+
+# (column header, row key, format) for every column in the summary table
+SUMMARY_COLUMNS = [
+    ("Symbol", "symbol", "{}"),
+    ("Points", "points", "{}"),
+    ("Current IV", "current_iv", "{:.4f}"),
+    ("Percentile", "percentile", "{:.1%}"),
+    ("Regime", "regime", "{}"),
+    ("Mean Regime Days", "regime_duration", "{:.1f}"),
+    ("Exp. Days to Revert", "time_to_revert", "{:.1f}"),
+    ("Fwd Slope", "slope1", "{:.4f}"),
+    ("Fwd R²", "r2_1", "{:.4f}"),
+    ("Diff Slope", "slope2", "{:.4f}"),
+    ("Diff R²", "r2_2", "{:.4f}"),
+    ("Regime Split", "x_intersection", "{:.4f}"),
+    ("High Slope", "slope_high", "{:.4f}"),
+    ("High R²", "r2_high", "{:.4f}"),
+    ("Low Slope", "slope_low", "{:.4f}"),
+    ("Low R²", "r2_low", "{:.4f}"),
+    ("Note", "error", "{}"),
+]
+
+
+def _format_cell(row, key, fmt):
+    value = row.get(key)
+    if value is None or value != value:     # None or NaN
+        return ""
+    return fmt.format(value)
+
+
+def _markdown_summary(rows, duration, bar_size):
+    lines = [
+        "# Implied Volatility Report",
+        "",
+        f"Generated {datetime.now():%Y-%m-%d %H:%M} | Range: {duration} | Bars: {bar_size}",
+        "",
+        "| " + " | ".join(header for header, _, _ in SUMMARY_COLUMNS) + " |",
+        "|" + "---|" * len(SUMMARY_COLUMNS),
+    ]
+
+    for row in rows:
+        cells = [_format_cell(row, key, fmt) for _, key, fmt in SUMMARY_COLUMNS]
+        if row.get("png"):
+            cells[0] = f"[{row['symbol']}]({row['png']})"
+        lines.append("| " + " | ".join(cells) + " |")
+
+    return "\n".join(lines) + "\n"
+
+
+def _html_summary(rows, duration, bar_size):
+    header = "".join(f"<th>{html.escape(h)}</th>" for h, _, _ in SUMMARY_COLUMNS)
+
+    body = []
+    for row in rows:
+        cells = [html.escape(_format_cell(row, key, fmt)) for _, key, fmt in SUMMARY_COLUMNS]
+        if row.get("png"):
+            cells[0] = f'<a href="{html.escape(row["png"])}">{cells[0]}</a>'
+        body.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Implied Volatility Report</title>
+<style>
+body {{ font-family: Arial, sans-serif; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+th {{ background: #eee; }}
+</style>
+</head>
+<body>
+<h1>Implied Volatility Report</h1>
+<p>Generated {datetime.now():%Y-%m-%d %H:%M} | Range: {html.escape(duration)} | Bars: {html.escape(bar_size)}</p>
+<table>
+<tr>{header}</tr>
+{chr(10).join(body)}
+</table>
+</body>
+</html>
+"""
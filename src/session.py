@@ -0,0 +1,106 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+"""
+Saves and restores the last dashboard session so a launch can put the previous analysis on screen before IB is even
+connected. Everything goes into one .npz: the series as raw numpy arrays (dates as int64 nanoseconds) and the small stuff
+(symbol, range, regression stats, regime state) as a JSON blob stored in a uint8 array, so no pickle is involved either way.
+
+"""
+
+DEFAULT_SESSION_PATH = os.path.join(os.path.expanduser("~"), ".iv_dashboard", "session.npz")
+
+# Bump if the layout below changes; older files are then ignored instead of half loaded
+SESSION_VERSION = 1
+
+# Scalar regression stats worth keeping; the frames and masks in the results dict are rebuilt from the series on restore
+RESULT_KEYS = ("slope1", "intercept1", "r1", "p1", "slope2", "intercept2", "r2", "p2", "x_intersection",
+               "slope_high", "intercept_high", "r_high", "p_high", "slope_low", "intercept_low", "r_low", "p_low")
+
+
+def _json_safe(value):
+    """ numpy scalars -> python, NaN / inf -> None so the metadata stays valid JSON. """
+
+    if value is None:
+        return None
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def save_session(path, symbol, iv_range, volatility_data, vol_annualization, results=None, regime_stats=None, bar_size="1 day"):
+    """ Writes the session atomically (temp file + rename) so a crash mid-save never leaves a corrupt session behind. """
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    meta = {
+        "version": SESSION_VERSION,
+        "saved_at": datetime.now().isoformat(timespec="seconds"),
+        "symbol": symbol,
+        "iv_range": iv_range,
+        "bar_size": bar_size,
+        "vol_annualization": vol_annualization,
+        "results": {key: _json_safe(results[key]) for key in RESULT_KEYS} if results is not None else None,
+    }
+
+    arrays = {
+        "dates": volatility_data.index.values.astype("datetime64[ns]").astype(np.int64),
+        "implied_vol": volatility_data["implied_vol"].to_numpy(dtype=np.float64),
+        "iv_percentile": volatility_data["iv_percentile"].to_numpy(dtype=np.float64),
+    }
+
+    if regime_stats is not None:
+        arrays["regime_codes"] = regime_stats["codes"]
+        arrays["transition_matrix"] = regime_stats["transition_matrix"]
+        arrays["transition_counts"] = regime_stats["transition_counts"]
+        arrays["time_to_revert"] = regime_stats["time_to_revert"]
+
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+
+    # np.savez adds .npz to names that don't already end in it, so keep the suffix on the temp file
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_session(path):
+    """
+    Reads a saved session back. Returns None if there isn't one or it can't be read.
+
+    The returned dict has the meta fields plus volatility_data (a dataframe) and the saved regime arrays if there were any.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as saved:
+            meta = json.loads(saved["meta"].tobytes().decode())
+            if meta.get("version") != SESSION_VERSION:
+                return None
+
+            index = pd.DatetimeIndex(saved["dates"].astype("datetime64[ns]"), name="date")
+            session = dict(meta)
+            session.setdefault("bar_size", "1 day")      # Sessions saved before bar sizes were selectable are all daily
+            session["volatility_data"] = pd.DataFrame({
+                "implied_vol": saved["implied_vol"],
+                "iv_percentile": saved["iv_percentile"],
+            }, index=index)
+
+            if "regime_codes" in saved:
+                session["regime_arrays"] = {
+                    "codes": saved["regime_codes"],
+                    "transition_matrix": saved["transition_matrix"],
+                    "transition_counts": saved["transition_counts"],
+                    "time_to_revert": saved["time_to_revert"],
+                }
+            else:
+                session["regime_arrays"] = None
+
+    except Exception as e:
+        print(f"Could not restore session from {path}: {e}")
+        return None
+
+    return session
@@ -0,0 +1,142 @@
+import pytest
+from src.alerts import AlertEngine
+
+"""
+Alert engine rules: regime entry with hysteresis (including one bar HIGH <-> LOW crossings), IV jumps and rate limiting.
+
+With a window of 10, the newest value's percentile is just its rank in the window: the largest value so far is 1.0 and
+the smallest is 0.1, which makes it easy to drive a symbol into HIGH or LOW on purpose.
+
+"""
+
+WINDOW = 10
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def engine(clock):
+    # Jumps off so the regime tests only see regime alerts (the seeded histories have near zero variance)
+    return AlertEngine(window=WINDOW, jump_k=float("inf"), min_interval=300, clock=clock)
+
+
+def seed_high(engine, symbol="SPY"):
+    """ Seeds a rising history so the last value tops the window and the symbol starts out in HIGH. """
+
+    engine.seed(symbol, [0.20 + 0.01 * i for i in range(WINDOW)])
+    assert engine.states[(symbol, "1 day")].zone == "HIGH"
+
+
+def kinds(alerts):
+    return [(alert["kind"], alert["message"].split(" entered ")[-1].split(" territory")[0]) for alert in alerts]
+
+
+def test_hysteresis_keeps_the_zone_inside_the_band(engine):
+    # Just under the HIGH edge but within the hysteresis band -> still HIGH, no flapping
+    assert engine._zone("HIGH", engine.high_edge - engine.hysteresis / 2) == "HIGH"
+    assert engine._zone(None, engine.high_edge - engine.hysteresis / 2) is None
+    assert engine._zone("HIGH", engine.high_edge - 2 * engine.hysteresis) is None
+
+    assert engine._zone("LOW", engine.low_edge + engine.hysteresis / 2) == "LOW"
+    assert engine._zone(None, engine.low_edge + engine.hysteresis / 2) is None
+    assert engine._zone("LOW", engine.low_edge + 2 * engine.hysteresis) is None
+
+
+def test_zone_crosses_straight_from_high_to_low_and_back(engine):
+    assert engine._zone("HIGH", engine.low_edge) == "LOW"
+    assert engine._zone("LOW", engine.high_edge + 0.01) == "HIGH"
+
+
+def test_iv_crush_from_high_to_low_in_one_bar_alerts(engine):
+    seed_high(engine)
+
+    # New window minimum -> percentile 0.1, straight from HIGH to LOW
+    engine.update("SPY", 0.10)
+    alerts = engine.evaluate()
+
+    assert ("REGIME", "LOW IV") in kinds(alerts)
+    assert engine.states[("SPY", "1 day")].zone == "LOW"
+
+
+def test_seeded_history_does_not_alert(engine):
+    seed_high(engine)
+    assert engine.evaluate() == []
+
+
+def test_jump_alert(clock):
+    engine = AlertEngine(window=WINDOW, min_jump_samples=5, clock=clock)
+    engine.seed("SPY", [0.20, 0.21] * WINDOW)
+    engine.update("SPY", 0.205)
+    assert engine.evaluate() == []
+
+    engine.update("SPY", 0.90)
+    assert "JUMP" in [kind for kind, _ in kinds(engine.evaluate())]
+
+
+def test_alerts_are_rate_limited_per_symbol(engine, clock):
+    seed_high(engine)
+
+    engine.update("SPY", 0.10)                  # HIGH -> LOW
+    assert len(engine.evaluate()) == 1
+
+    clock.now = 60
+    engine.update("SPY", 0.50)                  # LOW -> HIGH inside min_interval
+    assert engine.evaluate() == []
+    assert engine.states[("SPY", "1 day")].suppressed == 1
+
+    # Another symbol has its own budget
+    seed_high(engine, "QQQ")
+    engine.update("QQQ", 0.10)
+    assert len(engine.evaluate()) == 1
+
+    clock.now = 400
+    engine.update("SPY", 0.05)                  # HIGH -> LOW again, after min_interval
+    assert ("REGIME", "LOW IV") in kinds(engine.evaluate())
+
+
+def test_update_to_the_forming_bar_replaces_it(clock):
+    engine = AlertEngine(window=WINDOW, min_jump_samples=5, clock=clock)
+    dates = [f"2026-10-{day:02d}" for day in range(1, 2 * WINDOW + 1)]
+    engine.seed("SPY", [0.20, 0.21] * WINDOW, dates)
+    state = engine.states[("SPY", "1 day")]
+
+    # Today's bar first comes in quiet, then gets re-sent after IV has blown out intraday
+    engine.update("SPY", 0.205, "2026-10-21")
+    assert engine.evaluate() == []
+    before = (list(state.window), state.n_changes, state.change_mean, state.change_m2)
+
+    engine.update("SPY", 0.205, "2026-10-21")               # Same value again -> nothing to do
+    assert (list(state.window), state.n_changes, state.change_mean, state.change_m2) == before
+
+    engine.update("SPY", 0.90, "2026-10-21")
+    assert "JUMP" in [kind for kind, _ in kinds(engine.evaluate())]
+
+    # Replacing leaves exactly the state a fresh engine gets from the final value
+    fresh = AlertEngine(window=WINDOW, min_jump_samples=5, clock=clock)
+    fresh.seed("SPY", [0.20, 0.21] * WINDOW, dates)
+    fresh.update("SPY", 0.90, "2026-10-21")
+    expected = fresh.states[("SPY", "1 day")]
+
+    assert list(state.window) == list(expected.window)
+    assert state.sorted_window == expected.sorted_window
+    assert state.n_changes == expected.n_changes
+    assert state.change_mean == pytest.approx(expected.change_mean)
+    assert state.change_m2 == pytest.approx(expected.change_m2)
+    assert state.percentile == expected.percentile
+
+
+def test_older_bars_are_ignored(engine):
+    engine.seed("SPY", [0.20 + 0.01 * i for i in range(WINDOW)], [f"2026-10-{day:02d}" for day in range(1, WINDOW + 1)])
+    engine.update("SPY", 0.01, "2026-10-05")
+    assert engine.states[("SPY", "1 day")].last_iv == pytest.approx(0.29)
@@ -0,0 +1,27 @@
+import pandas as pd
+from src import analysis
+
+"""
+Lookback windows: intraday windows shrink to fit a short history, daily windows never do.
+
+"""
+
+
+def test_daily_windows_keep_a_full_year_on_short_ranges():
+    one_year = pd.date_range("2025-10-20", "2026-10-19", freq="B")
+
+    assert analysis.lookback_windows("1 day", one_year) == (pd.Timedelta(days=365), pd.Timedelta(days=42))
+    assert analysis.percentile_window_bars("1 day", one_year) == 252
+
+
+def test_intraday_windows_shrink_to_half_the_history():
+    # About a week of 5 min bars, less than two 10 day windows
+    index = pd.date_range("2026-10-12 09:30", "2026-10-16 16:00", freq="5min")
+    percentile_window, forward_horizon = analysis.lookback_windows("5 mins", index)
+
+    assert percentile_window == (index[-1] - index[0]) / 2
+    assert forward_horizon / percentile_window == pd.Timedelta(days=1) / pd.Timedelta(days=10)
+
+    # Enough history -> the full window
+    month = pd.date_range("2026-09-16 09:30", "2026-10-16 16:00", freq="5min")
+    assert analysis.lookback_windows("5 mins", month) == (pd.Timedelta(days=10), pd.Timedelta(days=1))
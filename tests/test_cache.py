@@ -0,0 +1,120 @@
+import time
+import threading
+import numpy as np
+from src.cache import ResultCache
+
+"""
+ResultCache guarantees: concurrent callers of one key share a single compute, the byte budget holds through eviction, and
+new data for a symbol drops only what was derived from that symbol.
+
+"""
+
+
+def test_concurrent_callers_of_one_key_share_one_compute():
+    cache = ResultCache()
+    calls = []
+    barrier = threading.Barrier(20)
+    results = [None] * 20
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "value"
+
+    def call(i):
+        barrier.wait()
+        results[i] = cache.get_or_compute(("fetch", "SPY"), compute, symbol="SPY", store=False)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == ["value"] * 20
+    assert cache.misses == 1 and cache.coalesced == 19
+
+    # store=False -> only shared with callers already waiting, not kept
+    assert ("fetch", "SPY") not in cache
+
+
+def test_failed_compute_is_raised_to_every_waiter_and_not_kept():
+    cache = ResultCache()
+
+    def compute():
+        raise TimeoutError("IB did not answer")
+
+    for _ in range(2):
+        try:
+            cache.get_or_compute("key", compute)
+            assert False, "should have raised"
+        except TimeoutError:
+            pass
+
+    assert cache.misses == 2
+    assert "key" not in cache
+
+
+def test_eviction_keeps_the_cache_within_its_byte_budget():
+    array_bytes = 8 * 1000
+    cache = ResultCache(max_bytes=5 * array_bytes)
+
+    for i in range(20):
+        cache.get_or_compute(("process", i), lambda: np.zeros(1000))
+        assert cache.current_bytes <= cache.max_bytes
+
+    assert len(cache) == 5
+
+    # Least recently used goes first: touch the oldest survivor, add one more, and the next oldest is the one evicted
+    cache.get_or_compute(("process", 15), lambda: np.zeros(1000))
+    cache.get_or_compute(("process", 20), lambda: np.zeros(1000))
+
+    assert ("process", 15) in cache
+    assert ("process", 16) not in cache
+    assert cache.current_bytes == sum(8 * 1000 for _ in range(len(cache)))
+
+
+def test_value_bigger_than_the_budget_is_not_kept():
+    cache = ResultCache(max_bytes=1000)
+    cache.get_or_compute("small", lambda: np.zeros(10))
+    cache.get_or_compute("huge", lambda: np.zeros(10_000))
+
+    assert "huge" not in cache
+    assert "small" in cache
+
+
+def test_new_bars_drop_only_that_symbols_entries():
+    cache = ResultCache()
+
+    versions = {}
+    for symbol in ("SPY", "QQQ"):
+        versions[symbol] = cache.update_data_version(symbol, ("20261016", 0.02), stream="1 day")
+        cache.get_or_compute(("process", symbol, "2 Y", versions[symbol]), lambda: np.zeros(10), symbol=symbol)
+
+    # Same bars again (e.g. switching back to a range / bar size already seen) -> nothing is dropped
+    assert cache.update_data_version("SPY", ("20261016", 0.02), stream="1 day") == versions["SPY"]
+    assert cache.update_data_version("SPY", ("20261016 15:55:00", 0.021), stream="5 mins") == versions["SPY"]
+    assert len(cache) == 2
+
+    # A new daily bar for SPY bumps its version and drops its entries, and leaves QQQ alone
+    new_version = cache.update_data_version("SPY", ("20261019", 0.03), stream="1 day")
+
+    assert new_version == versions["SPY"] + 1
+    assert ("process", "SPY", "2 Y", versions["SPY"]) not in cache
+    assert ("process", "QQQ", "2 Y", versions["QQQ"]) in cache
+    assert cache.version("QQQ") == versions["QQQ"]
+
+
+def test_result_computed_across_a_version_bump_is_not_kept():
+    cache = ResultCache()
+    cache.update_data_version("SPY", ("20261016", 0.02))
+
+    def compute():
+        # New bars land while this is still computing from the old ones
+        cache.update_data_version("SPY", ("20261019", 0.03))
+        return np.zeros(10)
+
+    cache.get_or_compute(("process", "SPY", 0), compute, symbol="SPY")
+
+    assert len(cache) == 0
@@ -0,0 +1,149 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from src.iv_server import IVServer, start_iv_client
+
+"""
+Checks the IV server against a fake IB app: identical requests from many clients must cost exactly one upstream fetch,
+and whatever those clients read out of the shared memory ring must be the same series.
+
+"""
+
+N_CLIENTS = 20
+
+
+class FakeIBApp():
+    """ Stands in for IBApp: counts requests and takes a while to answer, like a real historical data request. """
+
+    def __init__(self, delay=0.3, bars=600):
+        self.delay = delay
+        self.bars = bars
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def request_historical_iv(self, symbol, duration, bar_size="1 day", timeout=15):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+
+        dates = pd.bdate_range(end="2026-10-16", periods=self.bars)
+        closes = 0.02 + 0.005 * np.abs(np.random.default_rng(len(symbol)).standard_normal(self.bars))
+        return [{"date": date.strftime("%Y%m%d"), "close": float(close)} for date, close in zip(dates, closes)]
+
+
+@pytest.fixture
+def server():
+    ib_app = FakeIBApp()
+    server = IVServer(ib_app, address=("127.0.0.1", 0), ring_bytes=1024 * 1024, refresh_interval=3600, log=lambda message: None)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    assert server.ready.wait(5)
+
+    yield server
+
+    server.close()
+
+
+@pytest.fixture
+def clients(server):
+    clients = [start_iv_client(*server.address) for _ in range(N_CLIENTS)]
+    assert all(client is not None for client in clients)
+
+    yield clients
+
+    for client in clients:
+        client.disconnect()
+
+
+def run_clients(clients, target):
+    results = [None] * len(clients)
+
+    def run(i):
+        results[i] = target(i, clients[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    return results
+
+
+def test_burst_of_identical_requests_is_one_upstream_fetch(server, clients):
+    barrier = threading.Barrier(len(clients))
+
+    def request(i, client):
+        barrier.wait()
+        return client.request_historical_iv("SPY", "2 Y")
+
+    results = run_clients(clients, request)
+
+    assert server.ib_app.calls == 1
+    assert all(result == results[0] for result in results)
+    assert len(results[0]) == server.ib_app.bars
+
+
+def test_request_checking_freshness_just_before_the_fetch_finishes_shares_it(server, clients):
+    # Hold the second request between its freshness check (which still misses) and joining the fetch, until the first
+    # request's fetch has published and finished; it must then pick up the published entry rather than fetch again
+    first_done = threading.Event()
+    fresh_entry = server._fresh_entry
+    held = []
+
+    def held_fresh_entry(key):
+        entry = fresh_entry(key)
+
+        # The first miss seen while the upstream fetch is already under way is the second request's check
+        if entry is None and server.ib_app.calls == 1 and not held:
+            held.append(key)
+            first_done.wait(5)
+        return entry
+
+    server._fresh_entry = held_fresh_entry
+
+    def request(i, client):
+        if i == 1:
+            time.sleep(server.ib_app.delay / 3)
+        result = client.request_series("SPY", "2 Y")
+        if i == 0:
+            first_done.set()
+        return result
+
+    first, second = run_clients(clients[:2], request)
+
+    assert held
+    assert server.ib_app.calls == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert {"implied_vol", "iv_percentile", "regime"} <= set(first.columns)
+
+
+def test_stale_entries_are_dropped(server, clients):
+    server.max_age = 0.2
+
+    clients[0].request_series("SPY", "2 Y")
+    time.sleep(0.3)
+    clients[0].request_series("QQQ", "2 Y")
+
+    assert list(server.entries) == [("QQQ", "2 Y", "1 day")]
+
+
+def test_one_client_requesting_several_symbols_gets_them_fetched_side_by_side(server, clients):
+    server.ib_app.delay = 1.0
+    symbols = ["SPY", "QQQ", "AAPL", "NVDA", "TSLA", "IWM"]
+    client = clients[0]
+    barrier = threading.Barrier(len(symbols))
+
+    def request(i, _):
+        barrier.wait()
+        return client.request_series(symbols[i], "2 Y", timeout=3 * server.ib_app.delay)
+
+    started = time.perf_counter()
+    frames = run_clients([client] * len(symbols), request)
+    elapsed = time.perf_counter() - started
+
+    # Handled one message at a time these would take 6 delays and time out; side by side they take about one
+    assert all(frame is not None and len(frame) == server.ib_app.bars for frame in frames)
+    assert elapsed < 2 * server.ib_app.delay
+    assert server.ib_app.calls == len(symbols)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.colors import to_rgb
+from src.regimes import RegimeEngine
+
+"""
+Regression tests for the regime engine's reversion times and background shading.
+
+"""
+
+LOW, BELOW, NORMAL, ABOVE, HIGH = range(5)
+
+
+def revert_times(codes):
+    engine = RegimeEngine()
+    probabilities, _ = engine.transition_matrix(np.array(codes, dtype=np.int8))
+    return engine.expected_time_to_revert(probabilities)
+
+
+def test_regime_the_series_ends_in_does_not_stop_others_reverting():
+    times = revert_times([0, 0, 0, 2, 2, 0, 0, 2, 2, 4, 4, 4])
+
+    assert times[LOW] == 2.5
+    assert times[NORMAL] == 0.0
+    assert np.isinf(times[HIGH])
+
+
+def test_moving_into_an_unobserved_regime_is_not_reverting():
+    times = revert_times([2, 3, 3, 4])
+
+    assert np.isinf(times[ABOVE])
+    assert np.isinf(times[HIGH])
+
+
+def test_fully_connected_chain_solves_every_regime():
+    times = revert_times([0, 1, 2, 1, 0, 0, 3, 4, 3, 2, 2, 4, 4, 3, 2])
+
+    assert np.all(np.isfinite(times))
+    np.testing.assert_allclose(times, [4.1666667, 3.0833333, 0.0, 2.25, 3.75], rtol=1e-6)
+
+
+def band_rectangles(codes):
+    """ Runs the shading and returns {band color: [(start date, end date), ...]} for the rectangles drawn. """
+
+    index = pd.date_range("2026-01-01", periods=len(codes))
+    ax = Figure().subplots()
+    ax.plot(index, np.zeros(len(codes)))
+
+    engine = RegimeEngine()
+    engine.shade(ax, index, np.array(codes, dtype=np.int8))
+
+    x0 = ax.convert_xunits(index[:1])[0]
+    rectangles = {}
+    for collection in ax.collections:
+        color = next(c for c in engine.band_colors if c is not None and to_rgb(c) == tuple(collection.get_facecolor()[0][:3]))
+        spans = [(index[int(round(path.vertices[:, 0].min() - x0))], index[int(round(path.vertices[:, 0].max() - x0))])
+                 for path in collection.get_paths()]
+        rectangles[color] = sorted(spans)
+
+    return rectangles
+
+
+def test_runs_of_one_regime_are_shaded_separately():
+    rectangles = band_rectangles([HIGH] * 5 + [ABOVE] * 20 + [HIGH] * 5)
+
+    assert rectangles["red"] == [(pd.Timestamp("2026-01-01"), pd.Timestamp("2026-01-06")),
+                                 (pd.Timestamp("2026-01-26"), pd.Timestamp("2026-01-30"))]
+    assert rectangles["orange"] == [(pd.Timestamp("2026-01-06"), pd.Timestamp("2026-01-26"))]